@@ -1,11 +1,15 @@
 import numpy as np
+import operator
 
 
 class Arithmetic():
     def __init__(self):
         self.name = "Arithmetic Function"
-        self.description = "Performs simple arithmetic operations on two rasters."
+        self.description = "Performs simple arithmetic operations on two rasters, or on a raster and a constant."
         self.op = None
+        self.constant = None
+        self.pixelType = 'f4'
+        self.honorNoData = False
 
     def getParameterInfo(self):
         return [
@@ -21,9 +25,17 @@ class Arithmetic():
                 'name': 'r2',
                 'dataType': 'raster',
                 'value': None,
-                'required': True,
+                'required': False,
                 'displayName': "Raster B",
-                'description': ""
+                'description': "The second operand. When unspecified, Constant B is used instead."
+            },
+            {
+                'name': 'constant',
+                'dataType': 'numeric',
+                'value': 0,
+                'required': False,
+                'displayName': "Constant B",
+                'description': "The value of the second operand when Raster B is unspecified."
             },
             {
                 'name': 'op',
@@ -34,13 +46,23 @@ class Arithmetic():
                 'displayName': "Operation",
                 'description': ""
             },
+            {
+                'name': 'honorNoData',
+                'dataType': 'boolean',
+                'value': False,
+                'required': False,
+                'displayName': "Honor NoData?",
+                'description': ("If enabled, pixels that are NoData in either input, or whose result isn't finite--like division by zero, "
+                                "are skipped and set to NoData in the output.")
+            },
         ]
 
     def getConfiguration(self, **scalars):
         return {
             'inheritProperties': 2 | 4 | 8,
             'invalidateProperties': 2 | 4 | 8,
-            'resampling': True                                  # process at request resolution
+            'resampling': True,                                 # process at request resolution
+            'inputMask': bool(scalars.get('honorNoData', False))    # need input raster masks in .updatePixels() to honor NoData
         }
 
     def updateRasterInfo(self, **kwargs):
@@ -51,16 +73,54 @@ class Arithmetic():
         elif m == 'multiply':   self.op = np.multiply
         elif m == 'divide':     self.op = np.divide
 
+        self.honorNoData = bool(kwargs.get('honorNoData', False))
+
+        r1 = valueRange(kwargs['r1_info'].get('pixelType', None))
+        r2Info = kwargs.get('r2_info', None)
+        if r2Info:
+            self.constant = None
+            r2 = valueRange(r2Info.get('pixelType', None))
+        else:
+            c = float(kwargs.get('constant', None) or 0.)
+            self.constant = int(c) if c.is_integer() else c
+            if self.op is np.subtract and isinstance(self.constant, int):
+                self.op, self.constant = np.add, -self.constant     # r1 - c == r1 + (-c), and -c lies in the result range
+            r2 = (self.constant, self.constant) if isinstance(self.constant, int) else 'f4'
+
+        # compute straight into the narrowest pixel type that holds every possible result
+        self.pixelType = resultType(self.op, r1, r2)
+
+        kwargs['output_info']['pixelType'] = self.pixelType
         kwargs['output_info']['statistics'] = ()
         kwargs['output_info']['histogram'] = ()
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        r1 = np.array(pixelBlocks['r1_pixels'], dtype='f4', copy=False)
-        r2 = np.array(pixelBlocks['r2_pixels'], dtype='f4', copy=False)
+        r1 = pixelBlocks['r1_pixels']
+        r2 = pixelBlocks['r2_pixels'] if self.constant is None else self.constant
 
-        np.seterr(divide='ignore')
-        pixelBlocks['output_pixels'] = self.op(r1, r2).astype(props['pixelType'], copy=False)
+        outShape = np.broadcast(r1, r2).shape
+
+        if not self.honorNoData:
+            outBlock = np.empty(outShape, dtype=self.pixelType)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.op(r1, r2, out=outBlock, dtype=self.pixelType)
+        else:
+            valid = np.not_equal(pixelBlocks['r1_mask'], 0)
+            if self.constant is None:
+                valid = valid & np.not_equal(pixelBlocks['r2_mask'], 0)
+            if self.op is np.divide:
+                valid = valid & np.not_equal(r2, 0)             # don't divide by zero
+
+            outBlock = np.zeros(outShape, dtype=self.pixelType)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                self.op(r1, r2, out=outBlock, dtype=self.pixelType, where=valid)     # skip pixels that are NoData
+
+            if outBlock.dtype.kind == 'f':
+                valid = valid & np.isfinite(outBlock)           # overflow to infinity
+            pixelBlocks['output_mask'] = np.broadcast_to(valid, outShape).astype('u1')
+
+        pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False)
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
@@ -70,3 +130,36 @@ class Arithmetic():
             keyMetadata['wavelengthmin'] = None                 # reset inapplicable band-specific key metadata
             keyMetadata['wavelengthmax'] = None
         return keyMetadata
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+integerTypes = ('u1', 'i1', 'u2', 'i2', 'u4', 'i4')
+exactOperators = {np.add: operator.add, np.subtract: operator.sub, np.multiply: operator.mul}
+
+
+def valueRange(pixelType):
+    """Returns the (min, max) values of an integer pixel type, or the pixel type itself if it's floating-point."""
+    if pixelType in integerTypes:
+        i = np.iinfo(pixelType)
+        return (int(i.min), int(i.max))
+    return 'f8' if pixelType == 'f8' else 'f4'
+
+
+def resultType(op, r1, r2):
+    """Returns the narrowest integer type that holds op(a, b) for any a in r1 and b in r2, if +, - or * is applied
+       to integer ranges. Otherwise returns f4, or f8 if either operand is f8 or no 32-bit integer type suffices."""
+    if 'f8' in (r1, r2):
+        return 'f8'
+    if op not in exactOperators or isinstance(r1, str) or isinstance(r2, str):
+        return 'f4'
+
+    f = exactOperators[op]
+    v = [f(a, b) for a in r1 for b in r2]                   # extremes of +, -, * lie on the corners
+    for t in integerTypes:
+        i = np.iinfo(t)
+        if i.min <= min(v) and max(v) <= i.max:
+            return t
+    # f8 holds sums and differences of 32-bit integers exactly, and products up to 2**53 in magnitude.
+    # Larger products--e.g. i4 * i4, which reach 2**62--are rounded to 53 significant bits.
+    return 'f8'
@@ -0,0 +1,197 @@
+import numpy as np
+import ast
+import re
+
+
+class BandMath():
+
+    def __init__(self):
+        self.name = "Band Math Function"
+        self.description = ("Evaluates an arithmetic expression over bands of one or more input rasters. "
+                            "Use it to compute band indexes like NDVI, NDWI, NDSI, or dNBR.")
+        self.program = []           # [(ufunc, operands, destination), ...]
+        self.result = None          # buffer index--or constant--holding the result
+        self.bufferCount = 0
+        self.buffers = {}           # scratch buffers keyed by block shape
+
+    def getParameterInfo(self):
+        return [
+            {
+                'name': 'rasters',
+                'dataType': 'rasters',
+                'value': None,
+                'required': True,
+                'displayName': "Rasters",
+                'description': "The collection of overlapping input rasters referenced by the expression."
+            },
+            {
+                'name': 'expression',
+                'dataType': 'string',
+                'value': '(B2 - B1) / (B2 + B1)',
+                'required': True,
+                'displayName': "Expression",
+                'description': ("The expression to evaluate. Bn refers to band n of the first raster and "
+                                "RmBn refers to band n of raster m, e.g.: (R1B4 - R1B7) / (R1B4 + R1B7) - (R2B4 - R2B7) / (R2B4 + R2B7). "
+                                "Supported operators are +, -, *, /, and **, and these functions: "
+                                "sqrt, abs, exp, log, log10, sin, cos, tan, min, max.")
+            },
+        ]
+
+    def getConfiguration(self, **scalars):
+        return {
+          'compositeRasters': False,
+          'inheritProperties': 4 | 8,           # inherit all but the pixel type and NoData from the input raster
+          'invalidateProperties': 2 | 4 | 8,    # reset any statistics and histogram that might be held by the parent dataset (because this function modifies pixel values).
+          'inputMask': False                    # Don't need input raster mask in .updatePixels().
+        }
+
+    def updateRasterInfo(self, **kwargs):
+        infos = kwargs['rasters_info']
+        infos = infos if isinstance(infos, (tuple, list)) else (infos,)
+        bandCounts = [i.get('bandCount', 1) for i in infos]
+
+        compiler = _Compiler(bandCounts)
+        self.program, self.result, self.bufferCount = compiler.compile(kwargs.get('expression', None) or "")
+        self.buffers = {}
+
+        kwargs['output_info']['bandCount'] = 1          # output is a single band raster
+        kwargs['output_info']['pixelType'] = 'f4'
+        kwargs['output_info']['statistics'] = ()        # we know nothing about the stats of the outgoing raster.
+        kwargs['output_info']['histogram'] = ()
+        return kwargs
+
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        rasters = pixelBlocks['rasters_pixels']
+        rasters = rasters if isinstance(rasters, (tuple, list)) else (rasters,)
+        blockShape = rasters[0].shape[-2:]
+
+        if not isinstance(self.result, int):            # expression is a constant
+            pixelBlocks['output_pixels'] = np.full((1,) + blockShape, self.result, dtype=props['pixelType'])
+            return pixelBlocks
+
+        B = self.buffers.get(blockShape, None)
+        if B is None:
+            B = [np.empty(blockShape, dtype='f4') for k in range(self.bufferCount)]
+            self.buffers = {blockShape: B}              # only keep buffers for the latest block shape
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for f, operands, d in self.program:
+                if f is None:                           # load a band
+                    np.copyto(B[d], rasters[operands[0]][operands[1]], casting='unsafe')
+                else:
+                    f(*[B[k] if isinstance(k, int) else k for k in operands], out=B[d])
+
+        pixelBlocks['output_pixels'] = B[self.result].reshape((1,) + blockShape).astype(props['pixelType'])
+        return pixelBlocks
+
+    def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
+        if bandIndex == -1:
+            keyMetadata['datatype'] = 'Processed'               # outgoing raster is now 'Processed'
+        elif bandIndex == 0:
+            keyMetadata['wavelengthmin'] = None                 # reset inapplicable band-specific key metadata
+            keyMetadata['wavelengthmax'] = None
+            keyMetadata['bandname'] = 'BandMath'
+        return keyMetadata
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class _Compiler():
+    """Translates an expression into a list of (ufunc, operands, destination) instructions over float32 buffers.
+
+       Identical subexpressions are computed once, constant subexpressions are folded,
+       and buffers are reused as soon as the values they hold are no longer needed.
+    """
+
+    binaryOps = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+                 ast.Div: np.divide, ast.Pow: np.power}
+    functions = {'sqrt': np.sqrt, 'abs': np.absolute, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+                 'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'min': np.minimum, 'max': np.maximum}
+    commutative = (np.add, np.multiply, np.minimum, np.maximum)
+    bandPattern = re.compile(r'^(?:R(\d+))?B(\d+)$', re.IGNORECASE)
+
+    def __init__(self, bandCounts):
+        self.bandCounts = bandCounts
+        self.values = {}            # subexpression key -> value index
+        self.instructions = []      # (ufunc, operands, value index); operands are value indexes or constants
+
+    def compile(self, expression):
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise Exception("Invalid expression '{0}': {1}".format(expression, e))
+
+        result = self._visit(tree.body)
+        if not isinstance(result, int):
+            return [], result, 0
+        return self._allocate(result)
+
+    def _visit(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return np.float32(node.value)
+
+        if isinstance(node, ast.Name):
+            m = self.bandPattern.match(node.id)
+            if not m:
+                raise Exception("Unknown variable '{0}' in expression.".format(node.id))
+            r, b = int(m.group(1) or 1) - 1, int(m.group(2)) - 1
+            if r < 0 or r >= len(self.bandCounts) or b < 0 or b >= self.bandCounts[r]:
+                raise Exception("Expression refers to '{0}', which isn't a band of the input rasters.".format(node.id))
+            return self._emit(('band', r, b), None, (r, b))
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            v = self._visit(node.operand)
+            return v if isinstance(node.op, ast.UAdd) else self._apply(np.negative, [v])
+
+        if isinstance(node, ast.BinOp) and type(node.op) in self.binaryOps:
+            return self._apply(self.binaryOps[type(node.op)], [self._visit(node.left), self._visit(node.right)])
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id.lower() in self.functions \
+           and not node.keywords:
+            f = self.functions[node.func.id.lower()]
+            if len(node.args) != f.nin:
+                raise Exception("Function '{0}' expects {1} argument(s).".format(node.func.id, f.nin))
+            return self._apply(f, [self._visit(a) for a in node.args])
+
+        raise Exception("Unsupported construct in expression: '{0}'.".format(ast.dump(node)))
+
+    def _apply(self, f, operands):
+        if not any(isinstance(v, int) for v in operands):           # fold constants
+            with np.errstate(all='ignore'):
+                return np.float32(f(*operands))
+
+        if f in self.commutative:
+            operands = sorted(operands, key=lambda v: (not isinstance(v, int), float(v)))
+        key = (f.__name__,) + tuple(v if isinstance(v, int) else ('c', float(v)) for v in operands)
+        return self._emit(key, f, tuple(operands))
+
+    def _emit(self, key, f, operands):
+        v = self.values.get(key, None)
+        if v is None:
+            v = len(self.instructions)
+            self.instructions.append((f, operands, v))
+            self.values[key] = v
+        return v
+
+    def _allocate(self, result):
+        # last instruction that reads each value
+        lastUse = {result: len(self.instructions)}
+        for i, (f, operands, d) in enumerate(self.instructions):
+            if f is not None:
+                for k in operands:
+                    if isinstance(k, int):
+                        lastUse[k] = i
+
+        program, location, free, count = [], {}, [], 0
+        for i, (f, operands, d) in enumerate(self.instructions):
+            if f is not None:
+                operands = tuple(location[k] if isinstance(k, int) else k for k in operands)
+                for k in set(k for k in self.instructions[i][1] if isinstance(k, int)):
+                    if lastUse[k] == i:                 # ufuncs can safely write over their own inputs
+                        free.append(location[k])
+            if free:
+                location[d] = free.pop()
+            else:
+                location[d], count = count, count + 1
+            program.append((f, operands, location[d]))
+        return program, location[result], count
@@ -1,5 +1,5 @@
 import numpy as np
-import math
+import utils
 
 class BasicChuckClose():
 
@@ -7,7 +7,18 @@ class BasicChuckClose():
         self.name = "Basic Chuck Close"
         self.description = ("This python raster function is the first of which I "
             "plan to create that will transform imagery into artwork reminiscent of "
-            "Chuck Close.")
+            "Chuck Close. Class breaks come from the DEM's statistics, or from a sampled "
+            "pass over the DEM dataset when its path is known. Otherwise, they're sampled "
+            "from the first block requested, so the output depends on which block that is.")
+        self.invert = True
+        self.show_pix = False
+        self.square_size = 13
+        self.classes = 7
+        self.stamps = None
+        self.breaks = None
+        self.demInfo = None
+        self.demUri = None
+        self.statistics = utils.RasterStatistics()
 
     def getParameterInfo(self):
         return [
@@ -34,6 +45,22 @@ class BasicChuckClose():
                 'required': True,
                 'displayName': "Colorize Pixels?",
                 'description': "Gives pixels colors corresponding to their elevation."
+            },
+            {
+                'name': 'square_size',
+                'dataType': 'numeric',
+                'value': 13,
+                'required': False,
+                'displayName': "Square Size",
+                'description': "The width, in pixels, of each square of the mosaic."
+            },
+            {
+                'name': 'classes',
+                'dataType': 'numeric',
+                'value': 7,
+                'required': False,
+                'displayName': "Number of Classes",
+                'description': "The number of elevation classes, each painted with a differently-sized dot."
             }
         ]
 
@@ -53,57 +80,52 @@ class BasicChuckClose():
         kwargs['output_info']['noData'] = np.array([0], 'u1')
         self.invert = kwargs.get('inv')
         self.show_pix = kwargs.get('show_pix')
+        self.square_size = max(2, int(kwargs.get('square_size', None) or 13))
+        self.classes = max(2, int(kwargs.get('classes', None) or 7))
+        self.stamps = makeStamps(self.square_size, self.classes, self.invert)
+
+        # class breaks come from dataset statistics so that tiles are seamless
+        self.demInfo = kwargs['dem_info']
+        self.demUri = utils.rasterUri(kwargs, 'dem')
+        stats = self.demInfo.get('statistics', None)
+        if not stats or 'minimum' not in stats[0] or 'maximum' not in stats[0]:
+            r = self.statistics.get(self.demInfo, self.demUri)      # sampled pass over the whole dataset
+            stats = r[0] if r else None
+        self.breaks = classBreaks(stats[0], self.classes) if stats else None
         if not self.show_pix:
             kwargs['output_info']['statistics'] = ({'minimum': 0, 'maximum': 1.0}, )
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        #file = open(r'C:\PROJECTS\gbrunner-raster-functions\test.txt','w')
-        #file.write(str(z))
         # get the input DEM raster pixel block
         inBlock_dem = pixelBlocks['dem_pixels']
-        z = inBlock_dem.shape
-        #file.write(str(z)+'\n')
-        x, y = z[1],z[2]
-        chuck_close = np.zeros(z)
-        square_size = 13
-        pixel_buffer = 7
-        maximum = np.max(inBlock_dem)
-        minimum = np.min(inBlock_dem)
-        spread = maximum-minimum
-        break_size = spread/((pixel_buffer-1))
-        class_breaks = {}
-        for i in range(0,int(pixel_buffer)):
-            class_breaks[i] = minimum+i*break_size
-        num_squares_x = math.floor(x/square_size)
-        num_squares_y = math.floor(y/square_size)
-        #file.write(str(num_squares_x)+'\n')
-        #file.write(str(num_squares_y)+'\n')
-
-        for num_x in range(1,int(num_squares_x)):
-            for num_y in range(1,int(num_squares_y)):
-
-                pix = np.mean(inBlock_dem[0,num_x*square_size:(num_x+1)*square_size, num_y*square_size:(num_y+1)*square_size])
-                pixel_buffer = get_size(pix, class_breaks)
-
-##                chuck_close[num_x*square_size-pixel_buffer:num_x*square_size+pixel_buffer, num_y*square_size-pixel_buffer:num_y*square_size+pixel_buffer] = 1 #np.mean(dem[num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer])#dem[num_x*square_size, num_y*square_size]#-1*dem[num_x*square_size, num_y*square_size]+maximum
-                if self.invert:
-                    if self.show_pix:
-                        chuck_close[0,num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer]= pix #1 #np.mean(dem[num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer])#dem[num_x*square_size, num_y*square_size]#-1*dem[num_x*square_size, num_y*square_size]+maximum
-                    else:
-                        chuck_close[0,num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer]= 1
-
-                else:
-                    if self.show_pix:
-                        chuck_close[0,num_x*square_size-pixel_buffer:num_x*square_size+pixel_buffer, num_y*square_size-pixel_buffer:num_y*square_size+pixel_buffer] = pix #1 #np.mean(dem[num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer])#dem[num_x*square_size, num_y*square_size]#-1*dem[num_x*square_size, num_y*square_size]+maximum
-                    else:
-                        chuck_close[0,num_x*square_size-pixel_buffer:num_x*square_size+pixel_buffer, num_y*square_size-pixel_buffer:num_y*square_size+pixel_buffer] = 1
-
-        # format output cti pixels
-        outBlocks = chuck_close.astype(props['pixelType'], copy=False)
-        #file.write(outBlocks)
-        #file.close()
-        pixelBlocks['output_pixels'] = outBlocks
+        dem = inBlock_dem[0] if inBlock_dem.ndim > 2 else inBlock_dem
+        k = self.square_size
+        ny, nx = dem.shape[0] // k, dem.shape[1] // k
+        chuck_close = np.zeros((1,) + dem.shape, dtype=props['pixelType'])
+        if ny == 0 or nx == 0:
+            pixelBlocks['output_pixels'] = chuck_close
+            return pixelBlocks
+
+        # mean of each square, computed over a (ny, k, nx, k) view of the block
+        pix = dem[:ny*k, :nx*k].reshape(ny, k, nx, k).mean(axis=(1, 3), dtype='f8')
+
+        # class of each square is the index of the nearest of the equally-spaced class breaks
+        if self.breaks is None:     # no dataset statistics, sample the first block once
+            r = self.statistics.get(self.demInfo, self.demUri, tiles=[(tlc, inBlock_dem)])
+            if r is None:           # nothing but NoData, leave it as background and sample the next block
+                pixelBlocks['output_pixels'] = chuck_close
+                return pixelBlocks
+            self.breaks = classBreaks(r[0][0], self.classes)
+        sizes = np.digitize(pix, self.breaks, right=True)
+
+        # paint the per-class stamp of every square at once
+        painted = self.stamps[sizes]                            # (ny, nx, k, k)
+        if self.show_pix:
+            painted = painted * pix[:, :, None, None]
+        chuck_close[0, :ny*k, :nx*k] = painted.transpose(0, 2, 1, 3).reshape(ny*k, nx*k)
+
+        pixelBlocks['output_pixels'] = chuck_close
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
@@ -116,15 +138,20 @@ class BasicChuckClose():
         return keyMetadata
 
 
-def get_size(pixel_val, d):
-
-    diff = float('inf')
-    for key,value in d.items():
-        if diff > abs(pixel_val-value):
-            diff = abs(pixel_val-value)
-            x = key
+def classBreaks(stats, classes):
+    # midpoints between equally-spaced class values, for np.digitize() to pick the nearest class
+    values = np.linspace(stats['minimum'], stats['maximum'], classes)
+    return 0.5 * (values[:-1] + values[1:])
 
-    if diff==float('inf'):
-        x = 1
 
-    return x
+def makeStamps(square_size, classes, invert):
+    # one square mask per class with a centered dot whose width grows with the class index--
+    # or shrinks, when inverted, so that higher elevations are darker.
+    k = square_size
+    stamps = np.zeros((classes, k, k), dtype=bool)
+    for c in range(classes):
+        w = int(round(c * (k - 1.) / (classes - 1)))
+        w = k - w if invert else w
+        o = (k - w) // 2
+        stamps[c, o:o+w, o:o+w] = True
+    return stamps
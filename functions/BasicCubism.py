@@ -1,5 +1,5 @@
 import numpy as np
-import math
+import utils
 
 class BasicCubism():
 
@@ -7,7 +7,17 @@ class BasicCubism():
         self.name = "Basic Cubism"
         self.description = ("This python raster function sets the foundation for "
         "making cubism maps.  The takes a block of pixels, subdivides them into "
-        "larger chunks, and colorizes them by their elevation.")
+        "larger chunks, and colorizes them by their elevation. Class values come from the "
+        "DEM's statistics, or from a sampled pass over the DEM dataset when its path is known. "
+        "Otherwise, they're sampled from the first block requested, so the output depends on which block that is.")
+        self.square_size = 5
+        self.pixel_buffer = 1
+        self.classes = 0
+        self.stamp = None
+        self.values = None
+        self.demInfo = None
+        self.demUri = None
+        self.statistics = utils.RasterStatistics()
 
     def getParameterInfo(self):
         return [
@@ -18,6 +28,23 @@ class BasicCubism():
                 'required': True,
                 'displayName': "DEM Raster",
                 'description': "The digital elevation model (DEM)."
+            },
+            {
+                'name': 'square_size',
+                'dataType': 'numeric',
+                'value': 5,
+                'required': False,
+                'displayName': "Square Size",
+                'description': "The width, in pixels, of each chunk including its one-pixel border."
+            },
+            {
+                'name': 'classes',
+                'dataType': 'numeric',
+                'value': 0,
+                'required': False,
+                'displayName': "Number of Classes",
+                'description': ("The number of elevation classes the chunks are colorized by. "
+                                "Specify 0 to colorize each chunk by its mean elevation.")
             }
         ]
 
@@ -35,39 +62,59 @@ class BasicCubism():
         kwargs['output_info']['histogram'] = ()  # reset histogram
         kwargs['output_info']['pixelType'] = 'f4'
         kwargs['output_info']['noData'] = np.array([0], 'f4')
+
+        self.square_size = max(2*self.pixel_buffer + 1, int(kwargs.get('square_size', None) or 5))
+        self.classes = int(kwargs.get('classes', None) or 0)
+
+        # every chunk gets the same stamp: the square inside its border
+        k, b = self.square_size, self.pixel_buffer
+        self.stamp = np.zeros((k, k), dtype='f4')
+        self.stamp[b:k-b, b:k-b] = 1
+
+        # class values come from dataset statistics so that tiles are seamless
+        self.demInfo = kwargs['dem_info']
+        self.demUri = utils.rasterUri(kwargs, 'dem')
+        stats = self.demInfo.get('statistics', None)
+        if not stats or 'minimum' not in stats[0] or 'maximum' not in stats[0]:
+            r = self.statistics.get(self.demInfo, self.demUri)      # sampled pass over the whole dataset
+            stats = r[0] if r else None
+        self.values = self.classValues(stats[0]) if stats else None
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
         # get the input DEM raster pixel block
         inBlock_dem = pixelBlocks['dem_pixels']
+        dem = inBlock_dem[0] if inBlock_dem.ndim > 2 else inBlock_dem
+        k, b = self.square_size, self.pixel_buffer
+        ny, nx = dem.shape[0] // k, dem.shape[1] // k
+        cubism = np.zeros((1,) + dem.shape, dtype=props['pixelType'])
+        if ny == 0 or nx == 0:
+            pixelBlocks['output_pixels'] = cubism
+            return pixelBlocks
 
-        z = inBlock_dem.shape
-        x, y = z[1],z[2]
-        cubism = np.zeros(z)
+        # mean of the inside of each chunk, computed over a (ny, k, nx, k) view of the block
+        chunks = dem[:ny*k, :nx*k].reshape(ny, k, nx, k)
+        pix = chunks[:, b:k-b, :, b:k-b].mean(axis=(1, 3), dtype='f8')
 
-        #init_pixel_buffer = 10 change this
-        pixel_buffer = 1
-        square_size = 5
-        maximum = np.max(inBlock_dem)
-        minimum = np.min(inBlock_dem)
-        spread = maximum-minimum
-        break_size = spread/((square_size-1)-1)
-        class_breaks = {}
-        for i in range(1,int(square_size)-1):
-            class_breaks[i] = minimum+i*break_size
-        num_squares_x = math.floor(x/square_size)
-        num_squares_y = math.floor(y/square_size)
+        if self.classes > 1:
+            if self.values is None:     # no dataset statistics, sample the first block once
+                r = self.statistics.get(self.demInfo, self.demUri, tiles=[(tlc, inBlock_dem)])
+                if r is None:           # nothing but NoData, leave it as background and sample the next block
+                    pixelBlocks['output_pixels'] = cubism
+                    return pixelBlocks
+                self.values = self.classValues(r[0][0])
+            pix = self.values[np.digitize(pix, 0.5 * (self.values[:-1] + self.values[1:]), right=True)]
 
-        for num_x in xrange(0,int(num_squares_x)):
-            for num_y in xrange(0,int(num_squares_y)):
-            #chuck_close[num_x*square_size:(num_x+1)*square_size, num_y*square_size:(num_y+1)*square_size] = mean #dem[num_x*square_size, num_y*square_size]
-                cubism[0,num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer] = np.mean(inBlock_dem[0,num_x*square_size+pixel_buffer:(num_x+1)*square_size-pixel_buffer, num_y*square_size+pixel_buffer:(num_y+1)*square_size-pixel_buffer])#dem[num_x*square_size, num_y*square_size]#-1*dem[num_x*square_size, num_y*square_size]+maximum
+        # paint the stamp of every chunk at once
+        painted = pix[:, None, :, None] * self.stamp[None, :, None, :]
+        cubism[0, :ny*k, :nx*k] = painted.reshape(ny*k, nx*k)
 
-        # format output pixels
-        outBlocks = cubism.astype(props['pixelType'], copy=False)
-        pixelBlocks['output_pixels'] = outBlocks
+        pixelBlocks['output_pixels'] = cubism
         return pixelBlocks
 
+    def classValues(self, stats):
+        return np.linspace(stats['minimum'], stats['maximum'], max(self.classes, 2))
+
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
         if bandIndex == -1:                                 # dataset level
             keyMetadata['datatype'] = 'Scientific'
@@ -0,0 +1,134 @@
+import numpy as np
+from utils import loadJSON
+
+
+class CriteriaOverlay():
+
+    def __init__(self):
+        self.name = "Criteria Overlay Function"
+        self.description = ("Scores each pixel by the weighted sum of the range criteria it meets "
+                            "across one or more input rasters.")
+        self.rules = []             # [(raster index, min, max), ...]; bit k of a pixel is set if it meets rules[k]
+        self.lut = None             # score of each combination of bits
+        self.bitsType = 'u1'
+
+    def getParameterInfo(self):
+        return [
+            {
+                'name': 'rasters',
+                'dataType': 'rasters',
+                'value': None,
+                'required': True,
+                'displayName': "Rasters",
+                'description': "The single-band input rasters referenced by the rules."
+            },
+            {
+                'name': 'rules',
+                'dataType': 'string',
+                'value': ('[{"raster": 1, "min": 30, "max": 400}, '
+                          '{"raster": 2, "min": 5, "max": 60}, '
+                          '{"raster": 3, "min": 0, "max": 200}]'),
+                'required': True,
+                'displayName': "Rules",
+                'description': ("A JSON array--or path to a JSON file--of up to 16 criteria. Each criterion is an object like "
+                                "{\"raster\": 1, \"min\": 30, \"max\": 400, \"weight\": 1}, which is met by pixels of the specified "
+                                "(one-based) input raster whose value is strictly between min and max. "
+                                "An unspecified bound is unbounded, and weight defaults to 1. The defaults reproduce "
+                                "Vineyard Analysis given elevation, slope, and aspect rasters.")
+            },
+        ]
+
+    def getConfiguration(self, **scalars):
+        return {
+            'inheritProperties': 2 | 4 | 8,     # inherit all but the pixel type from the input raster
+            'invalidateProperties': 2 | 4 | 8,  # reset any statistics and histogram that might be held by
+                                                #   the parent dataset (because this function modifies pixel values).
+            'inputMask': True                   # We need the input raster mask in .updatePixels().
+        }
+
+    def updateRasterInfo(self, **kwargs):
+        infos = kwargs['rasters_info']
+        n = len(infos) if isinstance(infos, (tuple, list)) else 1
+
+        try:
+            s = (kwargs.get('rules', None) or "").strip()
+            rules = loadJSON(s) if s else []
+        except ValueError as e:
+            raise Exception("Unable to parse rules: {0}".format(e))
+
+        if not isinstance(rules, list) or not 0 < len(rules) <= 16:
+            raise Exception("Expected a list of 1 to 16 rules.")
+
+        self.rules, weights = [], []
+        for r in rules:
+            try:
+                i = int(r.get('raster', 1)) - 1
+                lo, hi = r.get('min', None), r.get('max', None)
+                self.rules.append((i, None if lo is None else float(lo), None if hi is None else float(hi)))
+                weights.append(float(r.get('weight', 1)))
+            except (AttributeError, TypeError, ValueError):
+                raise Exception("Invalid rule: {0}.".format(r))
+            if not 0 <= i < n:
+                raise Exception("Rule {0} refers to a raster that isn't an input.".format(r))
+
+        # score of every combination of criteria, indexed by the bits of the criteria met
+        self.bitsType = 'u1' if len(self.rules) <= 8 else 'u2'
+        bits = np.arange(1 << len(self.rules))
+        self.lut = np.zeros(bits.size)
+        for k, w in enumerate(weights):
+            self.lut += ((bits >> k) & 1) * w
+
+        lo, hi = float(self.lut.min()), float(self.lut.max())
+        pixelType = 'f4'
+        if all(w.is_integer() for w in weights):
+            pixelType = next((t for t in ('u1', 'i1', 'u2', 'i2', 'u4', 'i4')    # narrowest that holds lo and hi
+                              if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max), 'f8')
+        self.lut = self.lut.astype(pixelType)
+
+        kwargs['output_info']['bandCount'] = 1
+        kwargs['output_info']['pixelType'] = pixelType
+        kwargs['output_info']['statistics'] = ({'minimum': lo, 'maximum': hi}, )
+        kwargs['output_info']['histogram'] = ()
+        return kwargs
+
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        rasters = pixelBlocks['rasters_pixels']
+        masks = pixelBlocks['rasters_mask']
+        if not isinstance(rasters, (tuple, list)):
+            rasters, masks = (rasters,), (masks,)
+
+        blockShape = rasters[0].shape[-2:]
+        bits = np.zeros(blockShape, dtype=self.bitsType)
+        B, C = np.empty(blockShape, dtype=bool), np.empty(blockShape, dtype=bool)
+        T = np.empty(blockShape, dtype=self.bitsType)
+
+        # pack the criteria met by each pixel into the bits of a single integer
+        for k, (i, lo, hi) in enumerate(self.rules):
+            v = rasters[i][0]
+            B.fill(True)
+            if lo is not None:
+                np.greater(v, lo, out=C)
+                np.logical_and(B, C, out=B)
+            if hi is not None:
+                np.less(v, hi, out=C)
+                np.logical_and(B, C, out=B)
+            np.left_shift(B, k, out=T, dtype=self.bitsType)
+            np.bitwise_or(bits, T, out=bits)
+
+        mask = np.not_equal(masks[0][0], 0)
+        for m in masks[1:]:
+            np.logical_and(mask, m[0], out=mask)
+
+        pixelBlocks['output_pixels'] = self.lut.take(bits).reshape((1,) + blockShape).astype(props['pixelType'], copy=False)
+        pixelBlocks['output_mask'] = mask.reshape((1,) + blockShape).astype('u1', copy=False)
+        return pixelBlocks
+
+    def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
+        if bandIndex == -1:
+            keyMetadata['datatype'] = 'Scientific'
+            keyMetadata['variable'] = 'Suitability'
+        elif bandIndex == 0:
+            keyMetadata['wavelengthmin'] = None                 # reset inapplicable band-specific key metadata
+            keyMetadata['wavelengthmax'] = None
+            keyMetadata['bandname'] = 'Suitability'
+        return keyMetadata
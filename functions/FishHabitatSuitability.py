@@ -1,12 +1,19 @@
 import numpy as np
 
 
+# rating at each point of the trapezoids [minAcceptable, minPreferred, maxPreferred, maxAcceptable] below
+rating = (0., 1., 1., 0.)
+
+
 class FishHabitatSuitability():
 
     def __init__(self):
         self.name = "Fish Habitat Suitability Function"
         self.description = "Computes fish habitat suitability by depth."
         self.depth = 0.0
+        self.depthCurve = (0., 2., 11., 20.)
+        self.temperatureCurve = (17.99, 26.37, 29.15, 33.35)
+        self.salinityCurve = (28.81, 32.27, 35.81, 36.79)
 
     def getParameterInfo(self):
         return [
@@ -50,52 +57,17 @@ class FishHabitatSuitability():
         self.depth = abs(float(kwargs['depth']))
 
         # piece-wise linear parameters for depth...
-        d = self.depth
-        dMinA = 0
-        dMinP = 2
-        dMaxP = 11
-        dMaxA = 20
-
-        if d < dMinA or d > dMaxA:
-            d = 0.0
-        elif d <= dMinP:
-            d = (d - dMinA) / (dMinP - dMinA)
-        elif d >= dMaxP:
-            d = (d - dMaxA) / (dMaxP - dMaxA)
-        else:
-            d = 1
-
-        self.depth = d
+        self.depth = float(np.interp(self.depth, self.depthCurve, rating))
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        t = np.array(pixelBlocks['temperature_pixels'], dtype='f4', copy=False)
-        s = np.array(pixelBlocks['salinity_pixels'], dtype='f4', copy=False)
-
-        # piece-wise linear parameters for temperature...
-        tMinA = 17.99
-        tMinP = 26.37
-        tMaxP = 29.15
-        tMaxA = 33.35
-
-        np.putmask(t, t <= tMinP, (t - tMinA) / (tMinP - tMinA))
-        np.putmask(t, t >= tMaxP, (t - tMaxA) / (tMaxP - tMaxA))
-        np.putmask(t, (t > tMinP) & (t < tMaxP), 1)
-        np.putmask(t, t < 0, 0)
-
-        # piece-wise linear parameters for salinity...
-        sMinA = 28.81
-        sMinP = 32.27
-        sMaxP = 35.81
-        sMaxA = 36.79
-
-        np.putmask(s, s <= sMinP, (s - sMinA) / (sMinP - sMinA))
-        np.putmask(s, s >= sMaxP, (s - sMaxA) / (sMaxP - sMaxA))
-        np.putmask(s, (s > sMinP) & (s < sMaxP), 1)
-        np.putmask(s, s < 0, 0)
+        t = np.interp(pixelBlocks['temperature_pixels'], self.temperatureCurve, rating)
+        s = np.interp(pixelBlocks['salinity_pixels'], self.salinityCurve, rating)
 
         # get overall probability by tying all conditions
-        pixelBlocks['output_pixels'] = np.array(t * s * self.depth).astype(props['pixelType'], copy=False)
+        np.multiply(t, s, out=t)
+        np.multiply(t, self.depth, out=t)
+        pixelBlocks['output_pixels'] = t.astype(props['pixelType'], copy=False)
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
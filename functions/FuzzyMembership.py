@@ -1,5 +1,6 @@
 import numpy as np
 import math
+import utils
 
 
 class FuzzyMembership():
@@ -8,9 +9,17 @@ class FuzzyMembership():
         self.name = "Fuzzy Membership Function"
         self.description = ("Reclassifies or transforms the input data to a 0 to 1 "
                             "scale based on the possibility of being a member of a "
-                            "specified set")
+                            "specified set. Parameters derived from statistics use the input's statistics, "
+                            "or a sampled pass over the input dataset when its path is known. Otherwise, "
+                            "they're sampled from the first block requested, so the output depends on which block that is.")
         self.parA = {'minimum': 1., 'mid': None, 'meanMultipler': 1.}
         self.parB = {'maximum': 1., 'stdMultipler': 1., 'spreadA': 0.1, 'spreadB': 5.}
+        self.par1, self.par2 = None, None
+        self.rasterInfo = None
+        self.rasterUri = None
+        self.statistics = utils.RasterStatistics()
+        self.ready = False
+        self.program = []
 
     def getParameterInfo(self):
         return [
@@ -81,21 +90,33 @@ class FuzzyMembership():
         kwargs['output_info']['statistics'] = ({'minimum': 0.0, 'maximum': 1.0},)
 
         self.mode = kwargs['mode'].lower()  # input fuzzy membership mode
-        self.hedge = kwargs['hedge']  # to modify fuzzy membership values
+        self.hedge = (kwargs['hedge'] or 'None').lower()  # to modify fuzzy membership values
 
+        self.par1, self.par2 = kwargs['par1'], kwargs['par2']
+
+        # statistics of input raster, if they are known or the dataset can be sampled. Otherwise, sample them from the first pixel block.
+        self.rasterInfo = kwargs['raster_info']
+        self.rasterUri = utils.rasterUri(kwargs, 'raster')
+        r = self.statistics.get(self.rasterInfo, self.rasterUri)
+        self.ready = r is not None
+        if self.ready:
+            self.setParameters(r[0][0])
+
+        return kwargs
+
+    def setParameters(self, stats):
         # statistics of input raster
-        stats = kwargs['raster_info']['statistics'][0]
         self.mean, self.std = stats['mean'], stats['standardDeviation']
 
         # assignment of fuzzy membership parameters
-        if kwargs['par1'] != 0.0:
-            self.parA = self.parA.fromkeys(self.parA, kwargs['par1'])
+        if self.par1 != 0.0:
+            self.parA = self.parA.fromkeys(self.parA, self.par1)
         else:
             self.parA['minimum'] = stats['minimum']
             self.parA['mid'] = (stats['minimum']+stats['maximum'])/2
 
-        if kwargs['par2'] != 0.0:
-            self.parB = self.parB.fromkeys(self.parB, kwargs['par2'])
+        if self.par2 != 0.0:
+            self.parB = self.parB.fromkeys(self.parB, self.par2)
         else:
             self.parB['maximum'] = stats['maximum']
 
@@ -109,56 +130,75 @@ class FuzzyMembership():
            ((self.parB['spreadB'] < 1 or self.parB['spreadB'] > 10) and (self.mode == 'large' or self.mode == 'small')):
             raise Exception("Spread value out of range.")
 
-        return kwargs
+        self.program = self.compile()
 
-    def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        # get the input raster pixel block
-        r = np.array(pixelBlocks['raster_pixels'], dtype='f8', copy=False)
+    def compile(self):
+        # fuse the membership function, clipping and hedge into a sequence of in-place float32 ufuncs.
+        # each step is (ufunc, operand), applied as ufunc(r, operand, out=r)--or ufunc(r, out=r) if operand is None.
+        A, B = self.parA, self.parB
+        P = []
 
         # fuzzy linear membership
         if self.mode == "linear":
-            r = (r - self.parA['minimum']) / (self.parB['maximum'] - self.parA['minimum'])
+            P += [(np.subtract, A['minimum']), (np.multiply, 1. / (B['maximum'] - A['minimum']))]
 
         # fuzzy gaussian membership.
         elif self.mode == 'gaussian':
-            r = (np.e)**((-self.parB['spreadA']) * ((r - self.parA['mid'])**2))
+            P += [(np.subtract, A['mid']), (np.square, None), (np.multiply, -B['spreadA']), (np.exp, None)]
 
         # fuzzy large membership.
         elif self.mode == 'large':
-            r = (1 / (1 + ((r / self.parA['mid'])**(-self.parB['spreadB']))))
+            P += [(np.divide, A['mid']), (np.power, -B['spreadB']), (np.add, 1.), (np.reciprocal, None)]
 
         # fuzzy small membership.
         elif self.mode == 'small':
-            r = (1 / (1 + ((r / self.parA['mid'])**(self.parB['spreadB']))))
+            P += [(np.divide, A['mid']), (np.power, B['spreadB']), (np.add, 1.), (np.reciprocal, None)]
 
         # fuzzy near membership.
         elif self.mode == 'near':
-            r = (1 / (1 + (self.parB['spreadA'] * (r - self.parA['mid'])**2)))
-
-        # fuzzy mssmall membership.
-        elif self.mode == 'mssmall':
-            rTemp = (self.parB['stdMultipler'] * self.std) / (r - (self.parA['meanMultipler'] * self.mean) + (self.parB['stdMultipler'] * self.std))
-            np.putmask(r, r <= (self.mean * self.parA['meanMultipler']), 1.0)
-            np.putmask(r, r > (self.mean * self.parA['meanMultipler']), rTemp)
+            P += [(np.subtract, A['mid']), (np.square, None), (np.multiply, B['spreadA']), (np.add, 1.), (np.reciprocal, None)]
 
-        # fuzzy mslarge membership.
+        # fuzzy mssmall and mslarge membership.
         else:
-            rTemp = 1 - (self.parB['stdMultipler'] * self.std) / (r - (self.parA['meanMultipler'] * self.mean) + (self.parB['stdMultipler'] * self.std))
-            np.putmask(r, r <= (self.mean * self.parA['meanMultipler']), 0.0)
-            np.putmask(r, r > (self.mean * self.parA['meanMultipler']), rTemp)
+            m = A['meanMultipler'] * self.mean
+            s = B['stdMultipler'] * self.std
+            if s > 0:
+                # mssmall is 1 for r <= m, and s / (r - m + s) otherwise, i.e.: s / max(r - m + s, s)
+                P += [(np.add, s - m), (np.maximum, s), (np.reciprocal, None)]
+                P += [(np.multiply, s)] if self.mode == 'mssmall' else [(np.multiply, -s), (np.add, 1.)]
+            else:
+                P += [(np.less_equal if self.mode == 'mssmall' else np.greater, m)]
 
         # clip output values between [0.0, 1.0]
-        r = np.clip(r, 0.0, 1.0)
+        P += [(np.maximum, 0.), (np.minimum, 1.)]
 
         # hedge calculations
-        if (self.hedge == "SOMEWHAT"):  r = r ** 0.5
-        elif (self.hedge == "VERY"):    r = r ** 2
+        if self.hedge == 'somewhat':    P += [(np.sqrt, None)]
+        elif self.hedge == 'very':      P += [(np.square, None)]
 
-        if len(r.shape) > 2:
-            pixelBlocks['output_pixels'] = r[0].astype(props['pixelType'], copy=False)     # multi band raster
-        else:
-            pixelBlocks['output_pixels'] = r.astype(props['pixelType'], copy=False)        # single band raster
+        return P
 
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        if not self.ready:
+            p = pixelBlocks['raster_pixels']
+            r = self.statistics.get(self.rasterInfo, self.rasterUri, tiles=[(tlc, p)])
+            if r is None:           # nothing but NoData, output NoData and sample the next block
+                blockShape = p.shape[-2:]
+                pixelBlocks['output_pixels'] = np.zeros((1,) + blockShape, dtype=props['pixelType'])
+                pixelBlocks['output_mask'] = np.zeros((1,) + blockShape, dtype='u1')
+                return pixelBlocks
+            self.setParameters(r[0][0])
+            self.ready = True
+
+        # get the input raster pixel block as float32. This is the only allocation per block.
+        p = pixelBlocks['raster_pixels']
+        r = np.array(p[0] if p.ndim > 2 else p, dtype='f4')
+
+        for f, c in self.program:
+            if c is None:   f(r, out=r)
+            else:           f(r, c, out=r)
+
+        pixelBlocks['output_pixels'] = r.astype(props['pixelType'], copy=False)
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
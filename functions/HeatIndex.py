@@ -1,5 +1,14 @@
 import numpy as np
 
+
+# (a, b) such that Fahrenheit = a * t + b
+toFahrenheit = {'f': (1., 0.), 'c': (1.8, 32.), 'k': (1.8, -459.67)}
+
+# Rothfusz's regression model, R[i][j] being the coefficient of t^i * r^j with t in Fahrenheit
+rothfusz = np.array([[-42.379, 10.14333127, -5.481717e-2],
+                     [2.04901523, -0.22475541, 8.5282e-4],
+                     [-6.83783e-3, 1.22874e-3, -1.99e-6]])
+
 class HeatIndex():
 
     def __init__(self):
@@ -8,6 +17,8 @@ class HeatIndex():
                             "to return apparent temperature.")
         self.tempUnits = 'f'
         self.hiUnits = 'f'
+        self.stripPixels = 8192     # pixels per strip of rows evaluated at once
+        self.coefficients = {}
 
     def getParameterInfo(self):
         return [
@@ -68,54 +79,129 @@ class HeatIndex():
         self.hiUnits = kwargs.get('outunits', None)
         self.hiUnits = (self.hiUnits or 'Fahrenheit').lower()[0] 
 
+        self.coefficients = self.foldUnits(toFahrenheit.get(self.tempUnits, toFahrenheit['f']),
+                                           toFahrenheit.get(self.hiUnits, toFahrenheit['f']))
         return kwargs
 
+    def foldUnits(self, inUnits, outUnits):
+        # rewrite the model in terms of input temperature t = (Fahrenheit - b) / a,
+        # and output heat index (HI - q) / p, so that no pixels need converting
+        (a, b), (p, q) = inUnits, outUnits
+        c = {}
+
+        # simple heat index: (1.1F + .047r - 10.3 - q) / p, computed as (ct*t + r) * cr + c0
+        c['simple'] = (1.1 * a / .047, .047 / p, (1.1 * b - 10.3 - q) / p)
+
+        # full model is used where (simple + F) / 2 > 80, i.e. where (2.1a / .047)*t + r > (170.3 - 2.1b) / .047
+        c['useFull'] = (2.1 * a / .047, (170.3 - 2.1 * b) / .047)
+
+        # full regression model: substitute F = a*t + b and expand each power of F binomially
+        M = np.zeros((3, 3))                                # F^i = sum of M[k, i] * t^k
+        for i, binomial in enumerate(((1,), (1, 1), (1, 2, 1))):
+            for k in range(i + 1):
+                M[k, i] = binomial[k] * a ** k * b ** (i - k)
+        R = M.dot(rothfusz) / p
+        R[0, 0] -= q / p
+        c['full'] = R
+
+        # adjustments: thresholds and scale factors in input units
+        t = lambda F: (F - b) / a
+        c['low'] = (t(80.), t(112.), t(95.), -a / 17., -.25 / p, 3.25 / p)
+        c['high'] = (t(80.), t(87.), t(85.), .02 * a * a / p)
+        return c
+
+
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        t = np.array(pixelBlocks['temperature_pixels'], dtype='f4', copy=False)[0].flatten()
-        r = np.array(pixelBlocks['rh_pixels'], dtype='f4', copy=False)[0].flatten()
-
-        # transform t to Fahrenheit
-        if self.tempUnits == 'k':
-            t = (1.8 * t) - 459.67
-        elif self.tempUnits == 'c':
-            t = (1.8 * t) + 32.
-
-        tr = t * r
-        rr = r * r
-        tt = t * t
-        ttr = tt * r
-        trr = t * rr
-        ttrr = ttr * r
-
-        # compute simple heat index
-        H = .5 * (t + 61. + (((t - 68.) * 1.2) + (r * .094)))   # simple heat index
-        a = ((H + t) / 2.) > 80
-
-        # compute heat-index using Rothfusz's full regression model
-        fullHI = (-42.379 + (2.04901523 * t) + (10.14333127 * r) - (0.22475541 * tr) 
-                    - (6.83783e-3 * tt) - (5.481717e-2 * rr) + (1.22874e-3 * ttr) 
-                    + (8.5282e-4 * trr) - (1.99e-6 * ttrr))
-
-        # apply adjustments
-        c = a & ((r < 13) & (t >= 80.) & (t <= 112))
-        fullHI[c] -= (((13. - r[c]) / 4.) * np.sqrt((17. - np.abs(t[c]-95.)) / 17.))
-
-        c = a & ((r > 85) & (t >= 80.) & (t <= 87))
-        tc = t[c]
-        fullHI[c] += (((tc - 85.) / 10.) * ((87. - tc) / 5.))
+        t, r = np.broadcast_arrays(pixelBlocks['temperature_pixels'][0], pixelBlocks['rh_pixels'][0])
+        H = np.empty(t.shape, dtype='f4')
 
-        # use full heat-index conditionally
-        H[a] = fullHI[a]
+        # evaluate in strips of rows small enough for the scratch buffers to stay in cache
+        n = max(1, self.stripPixels // max(1, t.shape[-1]))
+        scratch = [np.empty((n,) + t.shape[1:], dtype='f4') for k in range(5)] + \
+                  [np.empty((n,) + t.shape[1:], dtype=bool) for k in range(3)]
 
-        # transform HI to desired output units
-        if self.hiUnits == 'k':
-            H = (H + 459.67) / 1.8
-        elif self.hiUnits == 'c':
-            H = (H - 32.) / 1.8
+        with np.errstate(invalid='ignore'):
+            for i in range(0, t.shape[0], n):
+                j = min(i + n, t.shape[0])
+                self.computeStrip(t[i:j], r[i:j], H[i:j], [b[:j-i] for b in scratch])
 
         pixelBlocks['output_pixels'] = H.astype(props['pixelType'], copy=False).reshape(shape)
         return pixelBlocks
 
+    def computeStrip(self, t, r, H, scratch):
+        T, R, X, Y, Z, A, C, B = scratch
+        c = self.coefficients
+
+        if t.dtype == np.float32: T = t
+        else: np.copyto(T, t, casting='unsafe')
+        if r.dtype == np.float32: R = r
+        else: np.copyto(R, r, casting='unsafe')
+
+        # compute simple heat index, and where the full model applies
+        ct, cr, c0 = c['simple']
+        np.multiply(T, ct, out=H)
+        np.add(H, R, out=H)
+        np.multiply(H, cr, out=H)
+        np.add(H, c0, out=H)
+
+        ct, threshold = c['useFull']
+        np.multiply(T, ct, out=Y)
+        np.add(Y, R, out=Y)
+        np.greater(Y, threshold, out=A)
+
+        # compute heat-index using Rothfusz's full regression model, grouped by powers of r
+        K = c['full']
+        np.multiply(T, K[2, 2], out=X)
+        np.add(X, K[1, 2], out=X)
+        np.multiply(X, T, out=X)
+        np.add(X, K[0, 2], out=X)
+        np.multiply(X, R, out=X)
+        np.multiply(T, K[2, 1], out=Y)
+        np.add(Y, K[1, 1], out=Y)
+        np.multiply(Y, T, out=Y)
+        np.add(Y, K[0, 1], out=Y)
+        np.add(X, Y, out=X)
+        np.multiply(X, R, out=X)
+        np.multiply(T, K[2, 0], out=Y)
+        np.add(Y, K[1, 0], out=Y)
+        np.multiply(Y, T, out=Y)
+        np.add(Y, K[0, 0], out=Y)
+        np.add(X, Y, out=X)
+
+        # apply adjustments: subtract ((13 - r) / 4) * sqrt((17 - |F - 95|) / 17) where (r < 13) & (80 <= F <= 112)
+        lo, hi, t95, ct, cr, c0 = c['low']
+        np.less(R, 13., out=C)
+        self.inRange(T, lo, hi, C, B)
+        np.subtract(T, t95, out=Y)
+        np.absolute(Y, out=Y)
+        np.multiply(Y, ct, out=Y)
+        np.add(Y, 1., out=Y)
+        np.sqrt(Y, out=Y, where=C)
+        np.multiply(R, cr, out=Z)
+        np.add(Z, c0, out=Z)
+        np.multiply(Y, Z, out=Y)
+        np.subtract(X, Y, out=X, where=C)
+
+        # add ((F - 85) / 10) * ((87 - F) / 5) where (r > 85) & (80 <= F <= 87)
+        lo, hi, t85, ct = c['high']
+        np.greater(R, 85., out=C)
+        self.inRange(T, lo, hi, C, B)
+        np.subtract(T, t85, out=Y)
+        np.subtract(hi, T, out=Z)
+        np.multiply(Y, Z, out=Y)
+        np.multiply(Y, ct, out=Y)
+        np.add(X, Y, out=X, where=C)
+
+        # use full heat-index conditionally
+        np.copyto(H, X, where=A)
+
+    def inRange(self, T, lo, hi, C, B):
+        # C &= (lo <= T <= hi), using B as scratch
+        np.greater_equal(T, lo, out=B)
+        np.logical_and(C, B, out=C)
+        np.less_equal(T, hi, out=B)
+        np.logical_and(C, B, out=C)
+
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
         if bandIndex == -1:                                     # update dataset-level key metadata
             keyMetadata['datatype'] = 'Scientific'
@@ -43,9 +43,6 @@ class HexagonPixels():
         x, y = inBlock_dem.shape
         x_pix_size = 9 #8
         y_pix_size = 7
-        maximum = np.max(inBlock_dem)
-        minimum = np.min(inBlock_dem)
-        spread = maximum-minimum
         num_squares_x = math.floor(x/x_pix_size)
         num_squares_y = math.floor(y/y_pix_size)
 
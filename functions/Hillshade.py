@@ -123,7 +123,7 @@ class Hillshade():
         # pixel size in input raster SR...
         p = props['cellSize'] if self.sr is None else projectCellSize(props['cellSize'], props['spatialReference'], self.sr, self.proj)
         if p is not None and len(p) == 2:
-            p = np.multiply(p, 1.11e5 if isGeographic(self.sr) else 1.)   # conditional degrees to meters conversion
+            p = np.multiply(p, 1.11e5 if isGeographic(self.sr, self.proj) else 1.)   # conditional degrees to meters conversion
             xs, ys = (self.zf + (np.power(p, self.ce) * self.cf)) / (8*p)
         else:
             xs, ys = 1., 1.         # degenerate case. shouldn't happen.
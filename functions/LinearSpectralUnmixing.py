@@ -1,4 +1,7 @@
 import numpy as np
+import ast
+import time
+from utils import loadJSON
 
 class LinearSpectralUnmixing():
 
@@ -8,6 +11,9 @@ class LinearSpectralUnmixing():
                             "input raster by performing linear spectral unmixing.")
         self.signatures = None      # ultimately will be a dict
         self.coefficients = None    # ultimately will be a transposed np array
+        self.pinv = None            # pseudo-inverse of coefficients, solves for abundances
+        self.residual = None        # projector onto the complement of the endmembers, yields residuals
+        self.solver = None          # fully constrained least squares solver of 'Scaled' abundances
         self.applyScaling = False
 
     def getParameterInfo(self):
@@ -30,7 +36,8 @@ class LinearSpectralUnmixing():
                 'required': True,
                 'displayName': "Endmember Training Signature Means",
                 'description': ("The training site means for each endmember classification for each band. "
-                                "Input value should adhere to Python dictionary or JSON formatting.")
+                                "Input value should adhere to Python dictionary or JSON formatting, "
+                                "or be the path to a JSON file.")
             },
             {
                 'name': 'method',
@@ -40,7 +47,8 @@ class LinearSpectralUnmixing():
                 'domain': ('Scaled', 'Raw'),
                 'displayName': 'Output Image Type',
                 'description': ('The type of output expected from this function. Specify "Scaled" for endmember '
-                                'abundance values constrained between 0.0 - 1.0 along with a calculation of r-squared (R2). '
+                                'abundance values constrained between 0.0 - 1.0 and to sum to one (fully constrained '
+                                'least squares) along with a calculation of r-squared (R2). '
                                 'Choose "Raw" for unaltered abundance values and residual sum of squares (RSS).')
             }
         ]
@@ -55,24 +63,46 @@ class LinearSpectralUnmixing():
 
     def updateRasterInfo(self, **kwargs):
         # get endmember input string value and convert to dict
-        s = kwargs['signatures']
-        self.signatures = eval(s)
+        s = (kwargs['signatures'] or "").strip()
+        try:
+            self.signatures = loadJSON(s)
+        except ValueError:
+            try:
+                self.signatures = ast.literal_eval(s)       # Python dictionary literal
+            except (ValueError, SyntaxError):
+                raise Exception("Unable to parse endmember signatures. Expected a JSON object or Python dictionary.")
+
+        if not isinstance(self.signatures, dict) or not len(self.signatures):
+            raise Exception("Expected endmember signatures as a dictionary of band values keyed by endmember name.")
 
         # convert input endmember signatures into arrays of each endmember across bands
         # [[vegB, vegG, vegR, ...], [shadowB, shadowG, shadowR, ...], [...]]
         # ... and then transpose signature axes to into arrays of each band's endmembers
         # [[vegB, shadowB, npvB, ...], [vegG, shadowG, npvG, ...], [...]]
         # assign to coefficients member var to use in np.linalg.lstsq()
-        self.coefficients = np.array(list(self.signatures.values())).T
+        try:
+            self.coefficients = np.array(list(self.signatures.values()), dtype='f8').T
+        except (TypeError, ValueError):
+            raise Exception("Endmember signatures must all have a numeric value for each band.")
+        if self.coefficients.ndim != 2:
+            raise Exception("Endmember signatures must all have a numeric value for each band.")
+
+        P = self.coefficients.shape
+        outBandCount = 1 + P[1]                                   # endmembers + residuals
+        inBandCount = kwargs['raster_info']['bandCount']
+        if P[0] != inBandCount:
+            raise Exception(("Incoming raster has {0} bands; endmember signatures "
+                             "indicate {1} input bands.").format(inBandCount, P[0]))
 
-        outBandCount = 1 + self.coefficients.shape[1]             # endmembers + residuals
-        # inBandCount = kwargs['raster_info']['bandCount']
-        # if P[0] != inBandCount:
-            # raise Exception(("Incoming raster has {0} bands; endmember signatures "
-                             # "indicate {1} input bands.").format(inBandCount, P[0]))
+        # factor the coefficients once: the least-squares abundances of pixel stacks y are pinv.y,
+        # and their residuals are y - coefficients.pinv.y, i.e. (I - coefficients.pinv).y
+        pinv = np.linalg.pinv(self.coefficients)
+        self.pinv = pinv.astype('f4')
+        self.residual = (np.eye(P[0]) - self.coefficients.dot(pinv)).astype('f4')
 
         # determine output pixel value method
         self.applyScaling = kwargs['method'].lower() == 'scaled'
+        self.solver = _FullyConstrainedSolver(self.coefficients) if self.applyScaling else None
         outStats = {
             'minimum': 0. if self.applyScaling else -10.,
             'maximum': 1. if self.applyScaling else 10.,
@@ -90,36 +120,37 @@ class LinearSpectralUnmixing():
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
         # get the input raster pixel block
         inBlock = pixelBlocks['raster_pixels']
+        nBands, nEndmembers = self.coefficients.shape
 
-        # transpose raster array axes into arrays of band values per pixel,
+        # flatten to a (bands, pixels) matrix whose columns are the pixel stacks to solve,
         # [B, G, R, NIR1, SWIR1, SWIR2] at each pixel
-        inBlockT = inBlock.transpose([1, 2, 0])
+        y = inBlock.reshape(nBands, -1).astype('f4', copy=False)
 
-        # reshape to slightly flatten to 2d array,
-        # and pixel stacks to solve must be transposed to (M,K) matrix of K columns
-        y = inBlockT.reshape(-1, inBlockT.shape[-1]).T
+        # abundances and residual sum of squares (RSS) are written straight into the output block
+        outBlocks = np.empty((nEndmembers + 1,) + inBlock.shape[1:], dtype='f4')
+        endmembers = outBlocks[:-1].reshape(nEndmembers, -1)
+        resid = outBlocks[-1].reshape(-1)
 
         # solve simultaneous equations with coefficients and each pixel stack
-        # store the model solution and residual sum of squares (RSS)
-        model, resid = np.linalg.lstsq(self.coefficients, y)[:2]
-
-        endmembers = np.array([endmember.reshape(-1, inBlock.shape[-1]) for endmember in model])
-        if self.applyScaling:
-            # clip negative values and scale from 0.0 to 1.0
-            endmembers.clip(min=0, out=endmembers)
-            endmembers *= (1.0 / endmembers.max())
-
-            # calculate R2
-            RSS = resid                                     # without modification, resid is in fact RSS
-            TSS = np.sum((y - y.mean())**2, axis=0)         # total sum of squares
-            R2 = 1 - RSS / TSS
-            resid = R2.reshape(1, -1, inBlock.shape[-1])
+        np.matmul(self.pinv, y, out=endmembers)
+
+        if not self.applyScaling:
+            r = np.matmul(self.residual, y)
+            np.einsum('ij,ij->j', r, r, out=resid)
         else:
-            resid = resid.reshape(1, -1, inBlock.shape[-1])  # extra dimension to match shape of endmembers
+            # non-negative abundances that sum to one, starting from the unconstrained ones
+            np.copyto(endmembers, self.solver.solve(y, endmembers), casting='unsafe')
 
-        outBlocks = np.row_stack((endmembers, resid))       # resid can be either RSS or R2
+            # calculate R2 = 1 - RSS/TSS of the constrained abundances, reusing r for deviations from the mean
+            r = np.matmul(self.coefficients.astype('f4'), endmembers)
+            np.subtract(y, r, out=r)
+            np.einsum('ij,ij->j', r, r, out=resid)
+            np.subtract(y, y.mean(dtype='f8'), out=r)
+            TSS = np.einsum('ij,ij->j', r, r)               # total sum of squares
+            np.divide(resid, TSS, out=resid)
+            np.subtract(1, resid, out=resid)
 
-        # output pixel arrays of abundances & residuals
+        # output pixel arrays of abundances & residuals (resid can be either RSS or R2)
         pixelBlocks['output_pixels'] = outBlocks.astype(props['pixelType'], copy=False)
         return pixelBlocks
 
@@ -137,6 +168,111 @@ class LinearSpectralUnmixing():
         return keyMetadata
 
 
+## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class _FullyConstrainedSolver():
+    """Solves min |A.x - y|^2 subject to x >= 0 and sum(x) = 1 for all pixel stacks y of a block at once.
+
+       A primal active-set method, vectorized across pixels: each pixel holds a feasible x and the set of endmembers
+       free to be non-zero (a bitmask). Every iteration solves the equality-constrained problem over each pixel's free
+       set--grouping pixels by set, with the solution operators of each set computed once--then either steps towards
+       that solution until an abundance reaches zero and frees it no longer, or, if the solution is feasible, frees the
+       endmember whose Lagrange multiplier is most negative, until none is. x starts from the unconstrained solution
+       projected onto the simplex, and stays feasible, so the iteration cap and time limit only bound its accuracy.
+    """
+
+    def __init__(self, A, maxIterations=50, timeLimit=2., tolerance=1e-6):
+        self.A = np.asarray(A, dtype='f8')
+        self.H = self.A.T.dot(self.A)
+        self.maxIterations = maxIterations
+        self.timeLimit = timeLimit                  # seconds per block
+        self.tolerance = tolerance * self.H.diagonal().max()
+        self.faces = {}                             # free set bitmask -> (P, q) such that x = P.y + q
+        self.bits = 1 << np.arange(self.A.shape[1])
+        self.stats = {}                             # iterations, seconds, and unconverged pixels of the last block
+
+    def solve(self, y, x0):
+        start = time.perf_counter()
+        y = np.asarray(y, dtype='f8')
+        x = projectOntoSimplex(np.asarray(x0, dtype='f8'))
+        free = self.bits.dot(x > 0)
+        I = np.arange(y.shape[1])                   # pixels that haven't converged
+
+        iterations = 0
+        while len(I) and iterations < self.maxIterations and time.perf_counter() - start < self.timeLimit:
+            iterations += 1
+            xI, yI, fI = x[:, I], y[:, I], free[I]
+            z = np.empty_like(xI)
+            for m in np.unique(fI):
+                J = np.flatnonzero(fI == m)
+                P, q = self._face(m)
+                z[:, J] = P.dot(yI[:, J]) + q
+
+            isFree = (fI & self.bits.reshape(-1, 1)) != 0
+            blocked = np.any(isFree & (z < 0), axis=0)
+
+            # infeasible: step from x towards z until the first abundance reaches zero, and fix it there
+            B = np.flatnonzero(blocked)
+            if len(B):
+                xB, zB = xI[:, B], z[:, B]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ratios = np.where(isFree[:, B] & (zB < 0), xB / (xB - zB), np.inf)
+                alpha = ratios.min(axis=0)
+                xB += alpha * (zB - xB)
+                reached = ratios <= alpha
+                xB[reached] = 0.
+                np.maximum(xB, 0., out=xB)
+                xI[:, B] = xB
+                fI[B] &= ~self.bits.dot(reached)
+
+            # feasible: optimal unless freeing an endmember lowers the residual
+            F = np.flatnonzero(~blocked)
+            converged = np.zeros(len(I), dtype=bool)
+            if len(F):
+                xF = z[:, F]
+                xI[:, F] = xF
+                g = self.H.dot(xF) - self.A.T.dot(yI[:, F])             # gradient
+                fixed = ~isFree[:, F]
+                mu = -np.sum(np.where(fixed, 0., g), axis=0) / np.maximum(np.sum(~fixed, axis=0), 1)
+                L = np.where(fixed, g + mu, np.inf)                     # multipliers of x >= 0
+                k = L.argmin(axis=0)
+                done = L[k, np.arange(len(F))] >= -self.tolerance
+                converged[F[done]] = True
+                fI[F[~done]] |= self.bits[k[~done]]
+
+            x[:, I], free[I] = xI, fI
+            I = I[~converged]
+
+        self.stats = {'iterations': iterations, 'seconds': time.perf_counter() - start, 'unconverged': len(I)}
+        return x
+
+    def _face(self, m):
+        """Returns the operators (P, q) of the least-squares solution x = P.y + q with sum(x) = 1 over free set m."""
+        f = self.faces.get(m, None)
+        if f is None:
+            S = np.flatnonzero(m & self.bits)
+            K = np.linalg.pinv(self.H[np.ix_(S, S)])
+            h = K.sum(axis=1)
+            n = h.sum()
+            P = np.zeros((len(self.bits), self.A.shape[0]))
+            q = np.zeros((len(self.bits), 1))
+            # unconstrained solution K.A'.y, corrected along h to sum to one
+            P[S] = (np.eye(len(S)) - np.outer(h, np.ones(len(S))) / n).dot(K).dot(self.A[:, S].T)
+            q[S, 0] = h / n
+            f = self.faces[m] = (P, q)
+        return f
+
+
+def projectOntoSimplex(V):
+    """Returns the Euclidean projection of each column of V onto the probability simplex."""
+    U = -np.sort(-V, axis=0)
+    css = np.cumsum(U, axis=0) - 1.
+    k = np.arange(1, len(V) + 1).reshape(-1, 1)
+    rho = len(V) - 1 - np.argmax((U - css / k > 0)[::-1], axis=0)      # last index where the condition holds
+    theta = np.take_along_axis(css, rho.reshape(1, -1), axis=0) / (rho + 1)
+    return np.maximum(V - theta, 0.)
+
+
 ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 
 """
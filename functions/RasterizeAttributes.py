@@ -1,6 +1,6 @@
 import numpy as np
 import json
-from utils import ZonalAttributesTable, loadJSON
+from utils import ZonalAttributesTable, loadJSON, zoneKey
 
 class RasterizeAttributes():
 
@@ -15,6 +15,8 @@ class RasterizeAttributes():
         self.whereClause = None
         self.M = 0                      # number of attribute names == additional bands in the output
         self.zid = None
+        self.ztArrays = None            # ztMap as (zone IDs, attribute values), valid only if ztTable is None
+        self.lookups = {}               # ztArrays compiled for lookup by output pixel type
 
     def getParameterInfo(self):
         return [
@@ -101,13 +103,17 @@ class RasterizeAttributes():
 
     def updateRasterInfo(self, **kwargs):
         self.ztMap = None
+        self.ztTable = None
         self.whereClause = None
+        self.ztArrays = None
+        self.lookups = {}
 
         ztStr = kwargs.get('ztable', None)
         ztStr = ztStr.strip() if ztStr else "{}"
 
         try:
             self.ztMap = loadJSON(ztStr) if ztStr else {}
+            self.ztMap = {zoneKey(k): v for k, v in self.ztMap.items()}     # JSON keys are always strings
         except ValueError as e:
             self.ztMap = None
 
@@ -121,6 +127,9 @@ class RasterizeAttributes():
                                                 idField=self.zid,
                                                 attribList=attribs)
 
+        if not self.ztTable:
+            self.ztArrays = attributeArrays(self.ztMap, self.M)
+
         self.background = kwargs.get('background', None)
         self.background = int(self.background) if self.background else 0
         self.whereClause = kwargs.get('where', None)
@@ -141,10 +150,15 @@ class RasterizeAttributes():
             z = z[0]
             zoneIds = np.unique(z)      #TODO: handle no-data and mask in zone raster
 
-        ZT = self.ztTable.query(idList=zoneIds, 
-                                where=self.whereClause, 
-                                extent=props['extent'], 
-                                sr=props['spatialReference']) if self.ztTable else self.ztMap
+        if self.ztTable:
+            ids, offsets, A = self.ztTable.queryArray(idList=zoneIds,
+                                                      where=self.whereClause,
+                                                      extent=props['extent'],
+                                                      sr=props['spatialReference'],
+                                                      firstRowOnly=True)
+            values = np.array([A[f].take(offsets[:-1]) for f in A.dtype.names[1:]]).reshape((-1, len(ids)))  # first row of each zone
+        else:
+            ids, values = self.ztArrays
 
         # output pixels initialized to background color
         p = np.full(shape=(1 + self.M,) + v.shape,      # band dimension is 1 more than #attributes 
@@ -152,18 +166,76 @@ class RasterizeAttributes():
                     dtype=props['pixelType'])
 
         np.copyto(p[0], v, casting='unsafe')
-        ones = np.ones(v.shape, dtype=bool)
-        # use zonal attributes to update output pixels...
-        if ZT is not None and len(ZT.keys()):
-            for k in (zoneIds if zoneIds is not None else [None]):
-                T = ZT.get(k, None)                     # k from z might not be in ztMap
-                if not T or not len(T):
-                    continue
 
-                I = (z == k) if z is not None else ones
-                for b,t in enumerate(T[0], 1):          # first band of p is v, skip it.
-                    if t is not None:
-                        p[b][I] = t
+        # use zonal attributes to update output pixels...
+        if len(ids):
+            if z is None:
+                I = np.isnan(ids)                           # rows not associated with a zone
+                row = values[:, I.argmax()] if I.any() else ()
+                for b, t in enumerate(row[:self.M], 1):     # first band of p is v, skip it.
+                    if not np.isnan(t):
+                        p[b].fill(t)
+            else:
+                L = self.lookups.get(p.dtype, None) if not self.ztTable else None
+                if L is None:
+                    L = _AttributeLookup(ids, values[:self.M], self.background, p.dtype, dense=z.dtype.kind in 'ui')
+                    if not self.ztTable:
+                        self.lookups[p.dtype] = L
+                L.take(z, out=p[1:])
 
         pixelBlocks['output_pixels'] = p
         return pixelBlocks
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+def attributeArrays(ztMap, M):
+    """Returns the zone IDs of { zoneId: [f1,f2,...,fn], ... }, and an (M, zones) array of their
+       attribute values--NaN if null. Zone IDs are NaN for rows not associated with a zone."""
+    ids, values = [], []
+    for k, T in ztMap.items():
+        row = T[0] if T and isinstance(T[0], (list, tuple)) else (T or ())   # first row of a zone, or the list itself
+        if isinstance(k, str) or not len(row):
+            continue
+        ids.append(np.nan if k is None else k)
+        values.append([np.nan if t is None else t for t in row[:M]] + [np.nan] * (M - len(row)))
+    return np.array(ids, dtype='f8'), np.array(values, dtype='f8').reshape((-1, M)).T
+
+
+class _AttributeLookup():
+    """Compiles the (M, zones) attribute values of zones into an (M, zones + 1) array--the last column
+       holding the background--so that all attribute bands of a block are gathered with a single take().
+
+       Columns are indexed directly by zone ID if the IDs are small non-negative integers,
+       or by the position of the zone ID among the sorted IDs otherwise.
+    """
+
+    def __init__(self, ids, values, background, dtype, dense=True):
+        I = ~np.isnan(ids)
+        ids, values = ids[I], values[:, I]
+        order = np.argsort(ids, kind='stable')
+        self.ids, values = ids[order], values[:, order]
+
+        n = len(self.ids)
+        self.dense = dense and n > 0 and np.all(np.mod(self.ids, 1) == 0) \
+                     and self.ids[0] >= 0 and self.ids[-1] < max(1 << 16, 4 * n)
+
+        columns = self.ids.astype(np.intp) if self.dense else np.arange(n)
+        self.backgroundColumn = int(columns.max()) + 1 if n else 0
+        self.lut = np.full((values.shape[0], self.backgroundColumn + 1), background, dtype=dtype)
+        for b in range(values.shape[0]):
+            J = ~np.isnan(values[b])                        # null attributes remain background
+            self.lut[b, columns[J]] = values[b, J]
+
+    def take(self, z, out):
+        if self.dense:
+            i = z.astype(np.intp)
+            np.putmask(i, (i < 0) | (i > self.backgroundColumn), self.backgroundColumn)    # zones missing from the table
+        else:
+            i = np.searchsorted(self.ids, z) if len(self.ids) else np.zeros(z.shape, dtype=np.intp)
+            np.minimum(i, max(len(self.ids) - 1, 0), out=i)
+            if len(self.ids):
+                np.putmask(i, self.ids.take(i) != z, self.backgroundColumn)
+            else:
+                i.fill(self.backgroundColumn)
+        np.take(self.lut, i, axis=1, out=out)
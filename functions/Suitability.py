@@ -0,0 +1,138 @@
+import numpy as np
+from utils import loadJSON
+
+
+class Suitability():
+
+    def __init__(self):
+        self.name = "Suitability Function"
+        self.description = ("Computes suitability from any number of input rasters, each rated by "
+                            "a trapezoid or piece-wise linear curve, and combines the ratings into a single score.")
+        self.curves = []            # [(xp, fp), ...], one per input raster
+        self.luts = []              # rating of every possible value of integer inputs, or None
+        self.method = 'product'
+
+    def getParameterInfo(self):
+        return [
+            {
+                'name': 'rasters',
+                'dataType': 'rasters',
+                'value': None,
+                'required': True,
+                'displayName': "Rasters",
+                'description': "The single-band input rasters, one for each variable of the model."
+            },
+            {
+                'name': 'curves',
+                'dataType': 'string',
+                'value': '[[17.99, 26.37, 29.15, 33.35], [28.81, 32.27, 35.81, 36.79]]',
+                'required': True,
+                'displayName': "Curves",
+                'description': ("A JSON array--or path to a JSON file--with a curve for each input raster, in order. "
+                                "A curve is either a trapezoid [minAcceptable, minPreferred, maxPreferred, maxAcceptable], "
+                                "or a list of [value, rating] points in increasing order of value. "
+                                "Ratings are linearly interpolated between points and held constant beyond the first and last.")
+            },
+            {
+                'name': 'method',
+                'dataType': 'string',
+                'value': 'Product',
+                'required': False,
+                'domain': ('Product', 'Minimum', 'Geometric Mean'),
+                'displayName': "Combine By",
+                'description': "The method used to combine the ratings of all input rasters into the output suitability."
+            },
+        ]
+
+    def getConfiguration(self, **scalars):
+        return {
+            'inheritProperties': 2 | 4 | 8,     # inherit everything but the pixel type (1)
+            'invalidateProperties': 2 | 4 | 8   # invalidate these aspects because we are modifying pixels and key metadata
+        }
+
+    def updateRasterInfo(self, **kwargs):
+        infos = kwargs['rasters_info']
+        infos = infos if isinstance(infos, (tuple, list)) else (infos,)
+
+        try:
+            s = (kwargs.get('curves', None) or "").strip()
+            curves = loadJSON(s) if s else []
+        except ValueError as e:
+            raise Exception("Unable to parse curves: {0}".format(e))
+
+        if not isinstance(curves, list) or len(curves) != len(infos):
+            raise Exception("Expected a curve for each of the {0} input rasters.".format(len(infos)))
+
+        self.curves = [parseCurve(c) for c in curves]
+        self.luts = [lookupTable(c, i.get('pixelType', None)) for c, i in zip(self.curves, infos)]
+        self.method = (kwargs.get('method', None) or 'Product').lower()
+
+        kwargs['output_info']['bandCount'] = 1
+        kwargs['output_info']['pixelType'] = 'f4'
+        kwargs['output_info']['statistics'] = ()
+        kwargs['output_info']['histogram'] = ()
+        return kwargs
+
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        rasters = pixelBlocks['rasters_pixels']
+        rasters = rasters if isinstance(rasters, (tuple, list)) else (rasters,)
+
+        outBlock = None
+        for p, (xp, fp), lut in zip(rasters, self.curves, self.luts):
+            v = p[0]
+            if lut is not None and v.dtype.kind in 'ui' and lut.size == 256 ** v.dtype.itemsize:
+                r = lut.take(v.view('u{0}'.format(v.dtype.itemsize)))    # one lookup per pixel
+            else:
+                r = np.interp(v, xp, fp)
+
+            if outBlock is None:
+                outBlock = r.astype('f4')
+            elif self.method == 'minimum':
+                np.minimum(outBlock, r, out=outBlock, casting='same_kind')
+            else:
+                np.multiply(outBlock, r, out=outBlock, casting='same_kind')
+
+        if self.method == 'geometric mean' and len(rasters) > 1:
+            np.power(outBlock, 1. / len(rasters), out=outBlock)
+
+        pixelBlocks['output_pixels'] = outBlock.reshape((1,) + outBlock.shape).astype(props['pixelType'], copy=False)
+        return pixelBlocks
+
+    def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
+        if bandIndex == -1:
+            keyMetadata['datatype'] = 'Scientific'
+            keyMetadata['variable'] = 'Suitability'
+        elif bandIndex == 0:
+            keyMetadata['wavelengthmin'] = None     # reset inapplicable band-specific key metadata
+            keyMetadata['wavelengthmax'] = None
+            keyMetadata['bandname'] = 'Suitability'
+        return keyMetadata
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+def parseCurve(c):
+    """Returns the (xp, fp) points of a trapezoid [minA, minP, maxP, maxA] or of a list of [value, rating] points."""
+    try:
+        p = np.array(c, dtype='f8')
+        if p.ndim == 1 and p.size == 4:
+            xp, fp = p, np.array([0., 1., 1., 0.])
+        elif p.ndim == 2 and p.shape[1] == 2 and p.shape[0] > 0:
+            xp, fp = p[:, 0], p[:, 1]
+        else:
+            raise ValueError()
+    except (TypeError, ValueError):
+        raise Exception("Invalid curve: {0}. Expected [minA, minP, maxP, maxA] or [[value, rating], ...].".format(c))
+
+    if np.any(np.diff(xp) < 0):
+        raise Exception("Invalid curve: {0}. Values must be in increasing order.".format(c))
+    return xp, fp
+
+
+def lookupTable(curve, pixelType):
+    """Returns the rating of every value of an 8- or 16-bit integer pixel type, indexed by the value's unsigned bits."""
+    if pixelType not in ('u1', 'i1', 'u2', 'i2'):
+        return None
+    n = int(pixelType[1])
+    values = np.arange(256 ** n, dtype='u{0}'.format(n)).view(pixelType)
+    return np.interp(values, *curve).astype('f4')
@@ -1,7 +1,8 @@
 import numpy as np
+import utils
 from numpy import pi
 #import datetime
-import scipy.stats as stats
+from collections import OrderedDict
 #from datetime import timedelta
 #import sys
 
@@ -28,9 +29,18 @@ class TopographicCCorrection():
 
     def __init__(self):
         self.name = 'Topographic C Correction'
-        self.description = 'Topographic C-Correction based on the paper from Teillet, Guindon, and Goodenough (1982).'
+        self.description = ('Topographic C-Correction based on the paper from Teillet, Guindon, and Goodenough (1982). '
+                            'The C coefficients are fitted to a sample of the whole scene when the input datasets '
+                            'share a grid and their paths are known. Otherwise, they are fitted to the first block '
+                            'requested and then kept, so the output depends on which block that is.')
 
         self.metadata = []
+        self.sun = []                       # (azimuth, zenith) of each scene, in radians
+        self.cacheBytes = 64 << 20          # bytes of terrain and illumination grids to hold, in all
+        self.cache = OrderedDict()          # ('terrain', tile) -> terrainTerms(), ('illumination', scene, tile) -> cos_i
+        self.cachedBytes = 0
+        self.C = None                       # [C of each band, ...], one array per scene
+        self.skipFactor = 4                 # regress on every 4th pixel of every 4th row
 
     def getParameterInfo(self):
         return [
@@ -40,7 +50,8 @@ class TopographicCCorrection():
                 'value': None,
                 'required': True,
                 'displayName': 'Rasters',
-                'description': 'The collection of overlapping rasters to aggregate.'
+                'description': ('The collection of overlapping scenes to correct--a time stack, for instance. '
+                                'Each scene needs sun azimuth and elevation in its key metadata.')
             },
             {
                 'name': 'slope',
@@ -62,6 +73,7 @@ class TopographicCCorrection():
 
     def getConfiguration(self, **scalars):
         return {
+            'compositeRasters': False,          # get the pixels of each scene separately
             'inheritProperties': 4 | 8,         # inherit everything but the pixel type (1) and NoData (2)
             'invalidateProperties': 2 | 4,      # invalidate histogram and statistics because we are modifying pixel values
             'inputMask': True,                  # need raster mask of all input rasters in .updatePixels().
@@ -70,15 +82,33 @@ class TopographicCCorrection():
         }
 
     def updateRasterInfo(self, **kwargs):
-        #outStats = {'minimum': -1, 'maximum': 1}
-        #self.outBandCount = 6
+        infos = kwargs['rasters_info']
+        infos = infos if isinstance(infos, (tuple, list)) else (infos,)
 
+        self.metadata = kwargs['rasters_keyMetadata']
+        self.metadata = self.metadata if isinstance(self.metadata, (tuple, list)) else (self.metadata,)
+
+        self.sun = []
+        for j in self.metadata:
+            az, el = j.get('sunazimuth', None), j.get('sunelevation', None)
+            if az is None or el is None:
+                raise Exception("Sun azimuth and elevation are required in the key metadata of each input raster.")
+            #https://en.wikipedia.org/wiki/Solar_zenith_angle
+            self.sun.append((az * pi/180, (90 - el) * pi/180))
+
+        self.cache.clear()
+        self.cachedBytes = 0
+        self.C = None
+
+        # fit C over the whole scene once, so that updatePixels() is a pure per-pixel correction
+        tiles = self.sceneTiles(kwargs)
+        if tiles is not None:
+            self.estimateCoefficients(tiles)
+
+        kwargs['output_info']['bandCount'] = sum(i.get('bandCount', 1) for i in infos)   # bands of all scenes, in order
         kwargs['output_info']['pixelType'] = 'f4'           # output pixels are floating-point values
         kwargs['output_info']['histogram'] = ()             # no statistics/histogram for output raster specified
         kwargs['output_info']['statistics'] = ()            # outStatsTuple
-
-        self.metadata = kwargs['rasters_keyMetadata']
-
         return kwargs
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
@@ -86,69 +116,190 @@ class TopographicCCorrection():
 
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        images = pixelBlocks['rasters_pixels']
+        images = images if isinstance(images, (tuple, list)) else (images,)
+        blockShape = images[0].shape[-2:]
+        tile = (tuple(tlc), blockShape, tuple(props.get('cellSize', None) or ()))
 
-        #fname = '{:%Y_%b_%d_%H_%M_%S}_t.txt'.format(datetime.datetime.now())
-        #filename = os.path.join(debug_logs_directory, fname)
-
-        image_pix_blocks = pixelBlocks['rasters_pixels']
-        image_pix_array = np.asarray(image_pix_blocks)
-        ##pickle_filename = os.path.join(debug_logs_directory, fname)
-        ##pickle.dump(image_pix_array, open(pickle_filename[:-4]+'landsat.p',"wb"))
-
-        slope_pix_blocks = pixelBlocks['slope_pixels']
-        slope_pix_array = np.asarray(slope_pix_blocks)
-        slope_rads = slope_pix_array * pi/180
-        ##pickle_filename = os.path.join(debug_logs_directory, fname)
-        ##pickle.dump(slope_rads, open(pickle_filename[:-4]+'slope.p',"wb"))
-
-        aspect_pix_blocks = pixelBlocks['aspect_pixels']
-        aspect_pix_array = np.asarray(aspect_pix_blocks)
-        aspect_rads = aspect_pix_array * pi/180
-        ##pickle_filename = os.path.join(debug_logs_directory, fname)
-        ##pickle.dump(aspect_rads, open(pickle_filename[:-4]+'aspect.p',"wb"))
-
-
-        t_vals = [j['acquisitiondate'] for j in self.metadata]
-        sun_az = [j['sunazimuth'] for j in self.metadata]
-        sun_el = [j['sunelevation'] for j in self.metadata]
-
-        #https://en.wikipedia.org/wiki/Solar_zenith_angle
-        sun_ze = [(90 - el) for el in sun_el]
-
+        if self.C is None:      # datasets couldn't be read, fit to a sample of the first block and keep it
+            self.estimateCoefficients([(tlc, pixelBlocks)])
 
         #Equation
         #Corrected Image = Image * (cos(solar zenith angle) + C)/(cos(solar incidence angle) + C)
         #Where C is an empiraicle parameter
-        #cos(solar incidence angle) =
-        pix_array_dim = image_pix_array.shape
-        num_bands = pix_array_dim[1]
-        num_squares_x = pix_array_dim[2]
-        num_squares_y = pix_array_dim[3]
-        result = np.zeros((num_bands, num_squares_x, num_squares_y))
-
-        if len(sun_az) == 1:
-            sun_az_rad = sun_az[0] * pi / 180
-            sun_ze_rad = sun_ze[0] * pi / 180
-
-            # Topographic Effect on Spectral Response from Nadir-Pointing Sensors
-            # https://www.asprs.org/wp-content/uploads/pers/1980journal/sep/1980_sep_1191-1200.pdf
-            cos_i = (np.cos(slope_rads[0, :, :]) * np.cos(sun_ze_rad)) + \
-                    (np.sin(slope_rads[0, :, :] * np.sin(sun_ze_rad)) * (np.cos(sun_az_rad - aspect_rads[0, :, :])))
-
-            for k in range(num_bands):
-                image_flattened = image_pix_array[0, k, :, :].ravel()
-                cos_gamma = cos_i.ravel()
-
-                # Adding linear regression from Dr. Mort Canty - https://github.com/mortcanty/CRCPython
-                m, b, r, _, _ = stats.linregress(cos_gamma, image_flattened)
-
-                C = b / m
-
-                result[k, :, :] = image_pix_array[0, k, :, :] * (np.cos(sun_ze_rad) + C) / (cos_i + C)
-
-
-        mask = np.ones((pix_array_dim[1], num_squares_x, num_squares_y))
-        pixelBlocks['output_mask'] = mask.astype('u1', copy = False)
+        result = np.empty((sum(len(p) for p in images),) + blockShape, dtype='f4')
+        D = np.empty(blockShape, dtype='f4')
+
+        b = 0
+        for s, image in enumerate(images):
+            cos_i = self.illuminationGrid(s, tile, pixelBlocks['slope_pixels'], pixelBlocks['aspect_pixels'])
+            cos_ze = np.cos(self.sun[s][1])
+
+            for k, C in enumerate(self.C[s]):
+                if not np.isfinite(C):          # no dependence on illumination (C is infinite), nothing to correct
+                    np.copyto(result[b], image[k], casting='unsafe')
+                else:
+                    np.add(cos_i, C, out=D)
+                    np.multiply(image[k], float(cos_ze + C), out=result[b], casting='unsafe')
+                    np.divide(result[b], D, out=result[b])
+                b += 1
+
+        pixelBlocks['output_mask'] = np.ones(result.shape, dtype='u1')
         pixelBlocks['output_pixels'] = result.astype(props['pixelType'], copy=False)
-
         return pixelBlocks
+
+    def estimateCoefficients(self, tiles):
+        """Fits the C coefficient of each band of each scene to a stream of (tlc, pixelBlocks) tiles--of the whole
+           scene or a subset of it--and keeps them for all subsequent requests, so the correction is seamless.
+           The pixel blocks are keyed like those of updatePixels(). Returns the coefficients.
+        """
+        sums = None
+        for tlc, pixelBlocks in tiles:
+            images = pixelBlocks['rasters_pixels']
+            images = images if isinstance(images, (tuple, list)) else (images,)
+            masks = pixelBlocks.get('rasters_mask', None)
+            masks = masks if masks is None or isinstance(masks, (tuple, list)) else (masks,)
+
+            valid = None
+            for m in (pixelBlocks.get('slope_mask', None), pixelBlocks.get('aspect_mask', None)):
+                if m is not None:
+                    valid = m[0] != 0 if valid is None else np.logical_and(valid, m[0], out=valid)
+
+            if sums is None:
+                sums = [_RegressionSums(len(p)) for p in images]
+
+            T = self.terrainTerms(pixelBlocks['slope_pixels'], pixelBlocks['aspect_pixels'])
+            for s, image in enumerate(images):
+                v = valid
+                if masks is not None:
+                    v = np.all(masks[s], axis=0) if v is None else np.logical_and(v, np.all(masks[s], axis=0))
+                sums[s].add(self.incidence(s, T), image, v, self.skipFactor)
+
+        if sums is not None:
+            self.C = [r.coefficients() for r in sums]
+        return self.C
+
+    def sceneTiles(self, kwargs):
+        """Returns a stream of (tlc, pixelBlocks) tiles of the whole scene for estimateCoefficients(), read from the
+           datasets of the input rasters, or None if arcpy or the path of any of them isn't available.
+        """
+        rasters, infos = kwargs.get('rasters', None), kwargs['rasters_info']
+        rasters = rasters if isinstance(rasters, (tuple, list)) else (rasters,)
+        infos = infos if isinstance(infos, (tuple, list)) else (infos,)
+        uris = [utils.datasetPath(r) for r in rasters] + [utils.rasterUri(kwargs, 'slope'), utils.rasterUri(kwargs, 'aspect')]
+        infos = list(infos) + [kwargs.get('slope_info', None) or {}, kwargs.get('aspect_info', None) or {}]
+        if not all(uris) or len(uris) != len(infos):
+            return None
+
+        readers = [utils.readRasterTiles(u, rowMultiple=self.skipFactor) for u in uris]
+        if any(r is None for r in readers):
+            return None
+
+        def tiles():
+            for T in zip(*readers):
+                blocks = [p.reshape((1,) + p.shape) if p.ndim == 2 else p for p in (np.asarray(p) for tlc, p in T)]
+                if any(p.shape[-2:] != blocks[0].shape[-2:] for p in blocks):
+                    return              # not on the same grid, pixels don't correspond
+                masks = [validPixels(p, i.get('noData', None)) for p, i in zip(blocks, infos)]
+                yield T[0][0], {'rasters_pixels': blocks[:-2], 'rasters_mask': masks[:-2],
+                                'slope_pixels': blocks[-2], 'slope_mask': masks[-2],
+                                'aspect_pixels': blocks[-1], 'aspect_mask': masks[-1]}
+        return tiles()
+
+    def illuminationGrid(self, scene, tile, slope, aspect):
+        """Returns the cosine of the solar incidence angle of each pixel of a tile of the specified scene."""
+        cos_i = self._recall(('illumination', scene, tile))
+        if cos_i is not None:
+            return cos_i
+
+        T = self._recall(('terrain', tile))
+        if T is None:
+            T = self._remember(('terrain', tile), self.terrainTerms(slope, aspect))
+        return self._remember(('illumination', scene, tile), self.incidence(scene, T))
+
+    def terrainTerms(self, slope, aspect):
+        """Returns cos(slope), sin(slope)*cos(aspect), and sin(slope)*sin(aspect) in float32."""
+        S = np.radians(slope[0], dtype='f4')
+        A = np.radians(aspect[0], dtype='f4')
+        cos_s = np.cos(S)
+        sin_s = np.sin(S, out=S)
+        P = np.cos(A)
+        P *= sin_s
+        Q = np.sin(A, out=A)
+        Q *= sin_s
+        return cos_s, P, Q
+
+    def incidence(self, scene, T):
+        """Returns the cosine of the solar incidence angle of each pixel for the specified scene, given terrainTerms()."""
+        # Topographic Effect on Spectral Response from Nadir-Pointing Sensors
+        # https://www.asprs.org/wp-content/uploads/pers/1980journal/sep/1980_sep_1191-1200.pdf
+        # cos_i = cos(slope)*cos(ze) + sin(slope)*sin(ze)*cos(az - aspect), with cos(az - aspect) expanded
+        az, ze = self.sun[scene]
+        cos_s, P, Q = T
+        cos_i = np.multiply(cos_s, float(np.cos(ze)))
+        W = np.multiply(P, float(np.sin(ze) * np.cos(az)))
+        cos_i += W
+        np.multiply(Q, float(np.sin(ze) * np.sin(az)), out=W)
+        cos_i += W
+        return cos_i
+
+    def _recall(self, key):
+        v = self.cache.get(key, None)
+        if v is not None:
+            self.cache.move_to_end(key)
+        return v
+
+    def _remember(self, key, v):
+        self.cache[key] = v
+        self.cachedBytes += _nbytes(v)
+        while self.cachedBytes > self.cacheBytes and len(self.cache) > 1:
+            k, w = self.cache.popitem(last=False)   # evict the least recently used grids
+            self.cachedBytes -= _nbytes(w)
+        return v
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+def _nbytes(v):
+    return sum(a.nbytes for a in v) if isinstance(v, tuple) else v.nbytes
+
+
+def validPixels(pixels, noData=None):
+    """Returns the mask--as a boolean array--of the pixels of each band that aren't NoData or NaN."""
+    valid = np.ones(pixels.shape, dtype=bool) if pixels.dtype.kind != 'f' else np.isfinite(pixels)
+    if noData is not None:
+        for b, v in enumerate(np.ravel(noData)[:len(pixels)]):
+            valid[b] &= pixels[b] != v
+    return valid
+
+
+class _RegressionSums():
+    """Sufficient statistics--sums of x, y, xy, x^2, and the count--of the regression of each band (y)
+       on the cosine of the solar incidence angle (x), accumulated tile by tile.
+
+       With the fit y = m*x + b, the C coefficient is b/m, as in Dr. Mort Canty's CRCPython.
+    """
+
+    def __init__(self, bandCount):
+        self.S = np.zeros((5, bandCount))           # rows: sum of x, y, xy, x^2, and n
+
+    def add(self, x, Y, valid=None, skip=1):
+        x, Y = x[::skip, ::skip], Y[:, ::skip, ::skip]
+        if valid is not None:
+            v = valid[::skip, ::skip]
+            x, Y = x[v], Y[:, v]
+        x = x.astype('f8').ravel()
+        Y = Y.reshape((len(Y), -1)).astype('f8')
+
+        self.S[0] += x.sum()
+        self.S[1] += Y.sum(axis=1)
+        self.S[2] += Y.dot(x)
+        self.S[3] += x.dot(x)
+        self.S[4] += x.size
+
+    def coefficients(self):
+        sx, sy, sxy, sxx, n = self.S
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m = (n*sxy - sx*sy) / (n*sxx - sx*sx)
+            b = (sy - m*sx) / n
+            return b / m
@@ -1,6 +1,14 @@
 import numpy as np
 
 
+# (a, b) such that Fahrenheit = a * t + b
+toFahrenheit = {'f': (1., 0.), 'c': (1.8, 32.), 'k': (1.8, -459.67)}
+
+# factor converting wind speed to mph. Knots are multiplied by 1.15077945 mph/knot; earlier
+# versions divided by it, so wind chill computed from knots differs from theirs, intentionally.
+toMPH = {'M': 1., 'm': 3600. / 1609.344, 'k': 1. / 1.609344, 'n': 1.15077945, 'f': 5280. / 3600}
+
+
 class Windchill():
 
     def __init__(self):
@@ -10,6 +18,7 @@ class Windchill():
         self.tUnits = 'f'
         self.wUnits = 'M'
         self.oUnits = 'f'
+        self.coefficients = (35.74, 0.6215, 0.4275, -35.75)
 
     def getParameterInfo(self):
         return [
@@ -88,41 +97,34 @@ class Windchill():
         else:
             self.wUnits = 'M'
 
+        # fold unit conversions into the coefficients of wc = c0 + c1*t + (c2*t + c3) * ws^0.16
+        a, b = toFahrenheit.get(self.tUnits, toFahrenheit['f'])     # input temperature to Fahrenheit
+        p, q = toFahrenheit.get(self.oUnits, toFahrenheit['f'])     # output from Fahrenheit: (wc - q) / p
+        k = toMPH[self.wUnits] ** 0.16
+        self.coefficients = ((35.74 + 0.6215 * b - q) / p,
+                             0.6215 * a / p,
+                             0.4275 * a * k / p,
+                             (0.4275 * b - 35.75) * k / p)
         return kwargs
 
     def updatePixels(self, tlc, size, props, **pixelBlocks):
-        ws = np.array(pixelBlocks['ws_pixels'], dtype='f4', copy=False)[0]
-        t = np.array(pixelBlocks['temperature_pixels'], dtype='f4', copy=False)[0]
+        ws = pixelBlocks['ws_pixels'][0]
+        t = pixelBlocks['temperature_pixels'][0]
 
-        m =  np.array(pixelBlocks['temperature_mask'], dtype=bool, copy=False)[0]
-        m &= np.array(pixelBlocks['ws_mask'], dtype=bool, copy=False)[0]
+        m = np.not_equal(pixelBlocks['temperature_mask'][0], 0)
+        m &= np.not_equal(pixelBlocks['ws_mask'][0], 0)
         m &= (ws >= 0)
 
-        # transform t to Fahrenheit
-        if self.tUnits == 'k':
-            t = (1.8 * t) - 459.67
-        elif self.tUnits == 'c':
-            t = (1.8 * t) + 32.
-
-        # transform ws to mph
-        if self.wUnits == 'm':
-            ws *= (3600./1609.344)
-        elif self.wUnits == 'k':
-            ws /= 1.609344
-        elif self.wUnits == 'n':
-            ws /= 1.15077945
-        elif self.wUnits == 'f':
-            ws *= (5280. / 3600)
-
-        wc = 35.74 + (0.6215 * t)
-        ws16 = np.power(ws[m], 0.16)
-        wc[m] += (0.4275 * t[m] * ws16) - (35.75 * ws16)
-
-        # transform output wind-chill index to desired output units
-        if self.oUnits == 'k':
-            wc = (wc + 459.67) / 1.8
-        elif self.oUnits == 'c':
-            wc = (wc - 32.) / 1.8
+        # wc = (c0 + c3*ws16) + t*(c1 + c2*ws16), where ws16 is zero outside the mask
+        c0, c1, c2, c3 = self.coefficients
+        ws16 = np.zeros(m.shape, dtype='f4')
+        np.power(ws, 0.16, out=ws16, where=m, dtype='f4')
+        wc = np.multiply(ws16, c2, dtype='f4')
+        np.add(wc, c1, out=wc)
+        np.multiply(wc, t, out=wc, dtype='f4')
+        np.multiply(ws16, c3, out=ws16)
+        np.add(ws16, c0, out=ws16)
+        np.add(wc, ws16, out=wc)
 
         pixelBlocks['output_pixels'] = wc.astype(props['pixelType'], copy=False)
         pixelBlocks['output_mask'] = m.astype(dtype='u1', copy=False)
@@ -1,6 +1,6 @@
 import numpy as np
 import json
-from utils import ZonalAttributesTable, loadJSON
+from utils import ZonalAttributesTable, loadJSON, zoneKey
 
 class ZonalRemap():
 
@@ -14,6 +14,7 @@ class ZonalRemap():
         self.background = 0
         self.defaultTarget = 255
         self.whereClause = None
+        self.thresholds = None          # ztMap compiled for lookup, valid only if ztTable is None
 
 
     def getParameterInfo(self):
@@ -134,6 +135,7 @@ class ZonalRemap():
 
     def updateRasterInfo(self, **kwargs):
         self.ztMap = None
+        self.ztTable = None
         self.whereClause = None
 
         ztStr = kwargs.get('ztable', None)
@@ -141,6 +143,7 @@ class ZonalRemap():
 
         try:
             self.ztMap = loadJSON(ztStr) if ztStr else {}
+            self.ztMap = {zoneKey(k): v for k, v in self.ztMap.items()}     # JSON keys are always strings
         except ValueError as e:
             self.ztMap = None
 
@@ -155,6 +158,7 @@ class ZonalRemap():
         self.background = int(kwargs.get('background', None) or 0)
         self.defaultTarget = int(kwargs.get('defzval', None) or 255)
         self.whereClause = kwargs.get('where', None)
+        self.thresholds = {}            # compiled lazily: with and without a zone raster
 
         kwargs['output_info']['bandCount'] = 1
         kwargs['output_info']['statistics'] = ()
@@ -182,20 +186,88 @@ class ZonalRemap():
 
         # use zonal thresholds to update output pixels...
         if ZT is not None and len(ZT.keys()):
-            for k in (zoneIds if zoneIds is not None else [None]):
-                T = ZT.get(k, None)         # k from z might not be in ztMap
-                if not T:
-                    continue
-
-                for t in T:
-                    I = (z == k) if z is not None else np.ones(v.shape, dtype=bool)
-                    if t[0] and t[1]:       # min and max are both available
-                        I = I & (v > t[0]) & (v < t[1])
-                    elif t[0]:
-                        I = I & (v > t[0])
-                    elif t[1]:
-                        I = I & (v < t[1])
-                    p[I] = (t[2] if t[2] is not None else self.defaultTarget)
+            T = self.thresholds.get(z is None, None) if not self.ztTable else None
+            if T is None:
+                T = _ZonalThresholds(ZT if z is not None else {0: ZT.get(None, None)}, self.background, self.defaultTarget)
+                if not self.ztTable:
+                    self.thresholds[z is None] = T
+            T.remap(v, z, out=p)
 
         pixelBlocks['output_pixels'] = p
         return pixelBlocks
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class _ZonalThresholds():
+    """Compiles zonal thresholds { zoneId: [[zMin, zMax, zVal], ...], ... } into sorted arrays.
+
+       The intervals of each zone split the value axis into pieces--open intervals between consecutive bounds
+       and the bounds themselves--and each piece takes the value of the last row covering it. A pixel is then
+       remapped by looking up its zone among the sorted zone IDs, and its piece among the sorted bounds of that zone.
+    """
+
+    def __init__(self, ztMap, background, defaultTarget):
+        self.background = background
+        self.ids = np.array(sorted(k for k in ztMap if k is not None and not isinstance(k, str) and ztMap[k]))
+
+        keys, pieces, self.nanValues = [], [], []
+        self.starts = np.zeros(len(self.ids) + 1, dtype='i8')         # offset of each zone's bounds in keys
+        for zi, k in enumerate(self.ids):
+            b, p, n = self._compileZone(ztMap[k], background, defaultTarget)
+            keys.append(zi + 1j * b)                                    # sorted by zone, then by value
+            pieces.append(p)
+            self.nanValues.append(n)
+            self.starts[zi + 1] = self.starts[zi] + len(b)
+
+        self.keys = np.concatenate(keys) if keys else np.zeros(0, dtype=complex)
+        self.pieces = np.concatenate(pieces) if pieces else np.zeros(0)
+        self.pieceStarts = 2 * self.starts[:-1] + np.arange(len(self.ids))    # each zone has 2n+1 pieces
+        self.nanValues = np.array(self.nanValues, dtype='f8')
+
+    def _compileZone(self, rows, background, defaultTarget):
+        bounds = np.unique([b for t in rows for b in t[:2] if b])      # a null or zero bound isn't tested
+
+        # a representative value for each piece: below, at, and above each bound
+        reps = np.empty(2 * len(bounds) + 1)
+        reps[0:-1:2] = np.nextafter(bounds, -np.inf)
+        reps[1::2] = bounds
+        reps[-1] = np.nextafter(bounds[-1], np.inf) if len(bounds) else 0.
+
+        values = np.full(reps.shape, background, dtype='f8')
+        nanValue = background           # NaN only satisfies rows without bounds
+        for t in rows:
+            I = np.ones(reps.shape, dtype=bool)
+            if t[0]: I &= reps > t[0]
+            if t[1]: I &= reps < t[1]
+            values[I] = t[2] if t[2] is not None else defaultTarget
+            if not t[0] and not t[1]:
+                nanValue = t[2] if t[2] is not None else defaultTarget
+        return bounds, values, nanValue
+
+    def remap(self, v, z, out):
+        if not len(self.ids):
+            return
+
+        if z is None:                   # zone-independent remapping
+            zi, valid = np.zeros(v.shape, dtype='i8'), None
+        else:
+            zi = np.searchsorted(self.ids, z)
+            np.minimum(zi, len(self.ids) - 1, out=zi)
+            valid = (self.ids.take(zi) == z)
+
+        key = np.multiply(v, 1j)
+        np.add(key, zi, out=key)
+        g = np.searchsorted(self.keys, key)                         # first bound of the zone not below v
+        i = g - self.starts.take(zi)
+        i *= 2
+        if len(self.keys):
+            i += (self.keys.take(g, mode='clip') == key)            # v is exactly on the bound
+        i += self.pieceStarts.take(zi)
+
+        np.copyto(out, self.pieces.take(i, mode='clip'), casting='unsafe')
+        if v.dtype.kind == 'f':
+            I = np.isnan(v)
+            out[I] = self.nanValues.take(zi[I])
+        if valid is not None:
+            out[~valid] = self.background                           # zones missing from the table
@@ -17,9 +17,13 @@ __all__ = ['isProductVersionOK',
            'computePixelBlockExtents',
            'computeCellSize',
            'Projection',
+           'CoordinateGrid',
            'Trace',
            'ZonalAttributesTable',
-           'projectCellSize',]
+           'projectCellSize',
+           'RasterStatistics',
+           'ChunkedRasterStore',
+           'runRasterFunction',]
 
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
@@ -48,47 +52,27 @@ def computeCellSize(props, sr=None, proj=None):
     if proj is None:
         proj = Projection()                                     # reproject extents
 
-    (xMin, yMin) = proj.transform(props['spatialReference'], sr, e[0], e[1])
-    (xMax, yMax) = proj.transform(props['spatialReference'], sr, e[2], e[3])
-    return (xMax-xMin)/w, (yMax-yMin)/h                         # cell size of parent raster
+    X, Y = proj.transform(props['spatialReference'], sr, (e[0], e[2]), (e[1], e[3]))   # both corners at once
+    return (X[1]-X[0])/w, (Y[1]-Y[0])/h                         # cell size of parent raster
 
 def projectCellSize(cellSize, inSR, outSR, proj=None):
-    inSRS = proj.createSR(inSR)
-    outSRS = proj.createSR(outSR)
-    if isGeographic(inSR) and isGeographic(outSR):
-        x =  cellSize[0] * (inSRS.radiansPerUnit/outSRS.radiansPerUnit)
-        y = cellSize[1] * (inSRS.radiansPerUnit/outSRS.radiansPerUnit)
-
-    elif not isGeographic(inSR) and not isGeographic(outSR):
-        x = cellSize[0] * (inSRS.metersPerUnit/outSRS.metersPerUnit)
-        y = cellSize[1] * (inSRS.metersPerUnit/outSRS.metersPerUnit)
-
-    elif isGeographic(inSR):
-        factor1 = inSRS.radiansPerUnit
-        factor1 = factor1/pi*180
-        factor2 = outSRS.metersPerUnit
-        if factor2 is None:
-            factor2 = 1
-        x = cellSize[0] * (factor1 * degreeToMeter)/factor2
-        y = cellSize[1] * (factor1 * degreeToMeter)/factor2 
-
-    elif isGeographic(outSR):
-        factor2 = outSRS.radiansPerUnit
-        factor2 = pi/180/factor2
-        factor1 = inSRS.metersPerUnit
-        if factor1 is None:
-            factor1 = 1
-        x = cellSize[0] * (factor2/degreeToMeter) * factor1
-        y = cellSize[1] * (factor2/degreeToMeter) * factor1
-
-    return x, y
-
-
-def isGeographic(s):
-    arcpy = __import__('arcpy')
-    sr = arcpy.SpatialReference()
-    sr.loadFromString(str(s) if isinstance(s, (str, int)) else s.exportToString())
-    return bool(sr.type == 'Geographic' and sr.angularUnitName)
+    if proj is None:
+        proj = Projection()
+
+    inGeographic, outGeographic = proj.isGeographic(inSR), proj.isGeographic(outSR)
+    inFactor, outFactor = proj.unitFactor(inSR), proj.unitFactor(outSR)     # radians or meters per unit
+    if inGeographic == outGeographic:
+        f = inFactor / outFactor
+    elif inGeographic:
+        f = (inFactor/pi*180) * degreeToMeter / outFactor                       # degrees, then meters per input unit
+    else:
+        f = inFactor / ((outFactor/pi*180) * degreeToMeter)
+
+    return cellSize[0] * f, cellSize[1] * f
+
+
+def isGeographic(s, proj=None):
+    return (proj or Projection()).isGeographic(s)
 
 
 def loadJSON(s):
@@ -105,29 +89,228 @@ def loadJSON(s):
         return json.loads(s)
 
 
+def rasterUri(kwargs, name):
+    """Returns the path of the dataset of raster parameter 'name', if the host passed one--as a string
+       or as an object with a catalogPath, like arcpy's Raster--or None."""
+    return datasetPath(kwargs.get(name, None))
+
+
+def datasetPath(v):
+    """Returns the path of a raster dataset given as a string or as an object with a catalogPath, or None."""
+    if isinstance(v, str):
+        return v or None
+    return getattr(v, 'catalogPath', None) or None
+
+
+def readRasterTiles(uri, tileRows=512, rowMultiple=1):
+    """Returns a generator of (tlc, pixels) tiles of full rows of a raster dataset, read top to bottom with arcpy--
+       tileRows rows at a time, rounded up to a multiple of rowMultiple--or None if arcpy isn't available."""
+    try:
+        arcpy = __import__('arcpy')
+    except ImportError:
+        return None
+
+    def tiles():
+        r = arcpy.Raster(uri)
+        e, h = r.extent, r.meanCellHeight
+        nRows = -(-tileRows // rowMultiple) * rowMultiple
+        for y0 in range(0, r.height, nRows):
+            n = min(nRows, r.height - y0)
+            ll = arcpy.Point(e.XMin, e.YMax - (y0 + n) * h)
+            yield (0, y0), arcpy.RasterToNumPyArray(r, ll, r.width, n)
+    return tiles()
+
+
+def zoneKey(k):
+    """Returns the zone ID represented by a JSON key: a number, None for 'null', or the string itself."""
+    try:
+        f = float(k)
+        return int(f) if f.is_integer() else f
+    except (TypeError, ValueError):
+        return None if k in ('', 'null', 'None') else k
+
+
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
 
 
 class Projection():
-    def __init__(self):
-        self.arcpy = __import__('arcpy')
-        self.inSR, self.outSR = None, None
+    """Transforms coordinates between spatial references given as WKIDs, strings, or spatial reference objects.
+
+       The backend is 'arcpy' or 'pyproj', defaulting to arcpy when it's available. Spatial reference objects--and
+       pyproj transformers--are created once per distinct spatial reference and reused. transform() accepts scalars
+       or arrays of coordinates, and projects all the points of an array in a single call to the backend.
+    """
+
+    def __init__(self, backend=None):
+        self.np = __import__('numpy')
+        self.arcpy, self.pyproj = None, None
+        if backend is None:
+            try:
+                self.arcpy = __import__('arcpy')
+            except ImportError:
+                self.pyproj = __import__('pyproj')
+        elif backend == 'arcpy':
+            self.arcpy = __import__('arcpy')
+        elif backend == 'pyproj':
+            self.pyproj = __import__('pyproj')
+        else:
+            raise Exception("Unknown projection backend: {0}".format(backend))
+
+        self.backend = 'arcpy' if self.arcpy else 'pyproj'
+        self.srs = {}               # key -> spatial reference object
+        self.transformers = {}      # (input key, output key) -> pyproj transformer
 
     def transform(self, inSR, outSR, x, y):
-        if self.inSR != inSR:
-            self.inSR = self.createSR(inSR)
-        if self.outSR != outSR:
-            self.outSR = self.createSR(outSR)
-    
-        p = self.arcpy.PointGeometry(self.arcpy.Point(x, y), self.inSR, False, False)
-        q = p.projectAs(self.outSR)
-        return q.firstPoint.X, q.firstPoint.Y
+        """Returns the (x, y) coordinates projected from inSR to outSR: a pair of floats if x and y are
+           scalars, or of float64 arrays of their broadcast shape otherwise."""
+        np = self.np
+        scalar = np.isscalar(x) and np.isscalar(y)
+        x, y = np.broadcast_arrays(np.asarray(x, dtype='f8'), np.asarray(y, dtype='f8'))
+
+        inKey, outKey = self.key(inSR), self.key(outSR)
+        if inKey == outKey:
+            X, Y = x.copy(), y.copy()
+        elif self.arcpy:
+            X, Y = self._arcpyTransform(self.createSR(inSR), self.createSR(outSR), x.ravel(), y.ravel())
+        else:
+            t = self.transformers.get((inKey, outKey), None)
+            if t is None:
+                t = self.pyproj.Transformer.from_crs(self.createSR(inSR), self.createSR(outSR), always_xy=True)
+                self.transformers[(inKey, outKey)] = t
+            X, Y = t.transform(x.ravel(), y.ravel())
+
+        X, Y = np.asarray(X, dtype='f8').reshape(x.shape), np.asarray(Y, dtype='f8').reshape(y.shape)
+        return (float(X), float(Y)) if scalar else (X, Y)
 
     def createSR(self, s):
-        sr = self.arcpy.SpatialReference()
-        sr.loadFromString(str(s) if isinstance(s, (str, int)) else s.exportToString())
+        k = self.key(s)
+        sr = self.srs.get(k, None)
+        if sr is None:
+            if self.arcpy:
+                sr = self.arcpy.SpatialReference()
+                sr.loadFromString(k)
+            elif k.isdigit():
+                try:
+                    sr = self.pyproj.CRS.from_user_input(int(k))
+                except self.pyproj.exceptions.CRSError:
+                    sr = self.pyproj.CRS.from_user_input('ESRI:{0}'.format(k))  # Esri WKIDs, like 102100
+            else:
+                sr = self.pyproj.CRS.from_user_input(k)
+            self.srs[k] = sr
         return sr
 
+    def isGeographic(self, s):
+        sr = self.createSR(s)
+        if self.arcpy:
+            return bool(sr.type == 'Geographic' and sr.angularUnitName)
+        return bool(sr.is_geographic)
+
+    def unitFactor(self, s):
+        """Returns the radians--if the spatial reference is geographic--or meters per unit of its coordinates."""
+        sr = self.createSR(s)
+        if self.arcpy:
+            f = sr.radiansPerUnit if self.isGeographic(s) else sr.metersPerUnit
+        else:
+            f = sr.axis_info[0].unit_conversion_factor if sr.axis_info else None
+        return f or 1.
+
+    def key(self, s):
+        """Returns the string that identifies a spatial reference--its WKID or well-known text."""
+        if isinstance(s, (str, int)):
+            return str(s)
+        return s.exportToString() if hasattr(s, 'exportToString') else s.to_wkt()
+
+    def _arcpyTransform(self, inSR, outSR, x, y):
+        arcpy = self.arcpy
+        if len(x) == 1:
+            q = arcpy.PointGeometry(arcpy.Point(x[0], y[0]), inSR, False, False).projectAs(outSR)
+            return (q.firstPoint.X,), (q.firstPoint.Y,)
+
+        points = arcpy.Array([arcpy.Point(a, b) for a, b in zip(x.tolist(), y.tolist())])
+        q = arcpy.Multipoint(points, inSR, False, False).projectAs(outSR)
+        if q is None or q.pointCount != len(x):         # points were dropped, project them one at a time
+            P = [arcpy.PointGeometry(arcpy.Point(a, b), inSR, False, False).projectAs(outSR).firstPoint
+                 for a, b in zip(x.tolist(), y.tolist())]
+        else:
+            P = q.getPart()
+        P = [(p.X, p.Y) for p in P]
+        return [p[0] for p in P], [p[1] for p in P]
+
+
+class CoordinateGrid():
+    """Map coordinates of the pixel centers of a pixel block, in the raster's spatial reference or in sr.
+
+       get(tlc, shape, props) returns (X, Y). In the raster's own spatial reference, the transform is affine and
+       X and Y are broadcastable 1-D axes, of shapes (1, cols) and (rows, 1). Otherwise, every step-th pixel
+       (and the last) is projected--in a single batched call--and X and Y are bilinearly interpolated from
+       that coarse grid into full (rows, cols) arrays.
+
+       Results are memoized--keyed by the raster's extent, dimensions, and spatial reference, and the block's
+       tlc and shape--for the last cacheSize blocks, so repeated requests cost nothing. They're read-only.
+    """
+
+    def __init__(self, sr=None, proj=None, step=16, cacheSize=64):
+        self.np = __import__('numpy')
+        self.sr = sr
+        self.proj = proj if proj is not None or sr is None else Projection()
+        self.step = max(1, int(step))
+        self.cacheSize = cacheSize
+        self.cache = __import__('collections').OrderedDict()     # (props key, tlc, shape) -> (X, Y)
+
+    def get(self, tlc, shape, props):
+        nRows, nCols = shape if len(shape) == 2 else shape[1:]
+        inSR = props.get('spatialReference', None)
+        affine = self.sr is None or self.proj.key(self.sr) == self.proj.key(inSR)
+        key = (tuple(props['extent']), props['width'], props['height'],
+               None if affine else self.proj.key(inSR), tuple(tlc), (nRows, nCols))
+
+        r = self.cache.get(key, None)
+        if r is not None:
+            self.cache.move_to_end(key)
+            return r
+
+        np = self.np
+        e, w, h = props['extent'], props['width'], props['height']
+        dX, dY = (e[2]-e[0])/w, (e[3]-e[1])/h
+        x = e[0] + (tlc[0] + 0.5 + np.arange(nCols)) * dX              # pixel centers
+        y = e[3] - (tlc[1] + 0.5 + np.arange(nRows)) * dY
+
+        if affine:
+            r = x.reshape((1, nCols)), y.reshape((nRows, 1))
+        else:
+            I, J = self._samples(nRows), self._samples(nCols)
+            X, Y = self.proj.transform(inSR, self.sr, x[J].reshape((1, -1)), y[I].reshape((-1, 1)))
+            r = self._interpolate(X, I, J, nRows, nCols), self._interpolate(Y, I, J, nRows, nCols)
+
+        for a in r:
+            a.setflags(write=False)
+        if self.cacheSize:
+            self.cache[key] = r
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return r
+
+    def _samples(self, n):
+        return self.np.unique(self.np.append(self.np.arange(0, n, self.step), n - 1))
+
+    def _interpolate(self, G, I, J, nRows, nCols):
+        i, t = self._weights(I, nRows)
+        j, u = self._weights(J, nCols)
+        t = t.reshape((-1, 1))
+        A = G[:, j] * (1. - u) + G[:, j + 1] * u       # along the sampled rows first, then across them
+        R = A[i] * (1. - t)
+        R += A[i + 1] * t
+        return R
+
+    def _weights(self, S, n):
+        """Returns, for each of n positions, the index k of the sample before it and its fraction of the way to sample k+1."""
+        np = self.np
+        if len(S) == 1:
+            return np.full(n, -1), np.zeros(n)          # G[-1] and G[0] are the same sample
+        p = np.arange(n)
+        k = np.clip(np.searchsorted(S, p, side='right') - 1, 0, len(S) - 2)
+        return k, (p - S[k]) / (S[k + 1] - S[k])
+
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
 
@@ -145,9 +328,139 @@ class Trace():
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
 
-# TODO: support early termination (when only one row is needed), like in non-zonal rasterize attributes.
+class RasterStatistics():
+    """Approximate band statistics and histograms of a raster, computed by sampling every skipFactorX-th
+       column of every skipFactorY-th row--like the statistics held in a raster's information.
+
+       Statistics already present in the raster information are used as is. Otherwise, when the dataset's
+       'uri' is known (see rasterUri()) and arcpy is available, they're computed once by a strided pass over
+       the whole dataset, memoized for all instances, and persisted in a JSON sidecar in cacheDir so subsequent
+       sessions get them without scanning the raster again--until the dataset's file is modified. Failing that,
+       they're computed from the given stream of (tlc, pixels) tiles only--a sample that isn't memoized. None is
+       returned if no valid pixel was sampled.
+    """
+
+    memo = {}                   # dataset key -> statistics, shared by all instances
+
+    def __init__(self, skipFactorX=10, skipFactorY=10, bins=256, cacheDir=None):
+        self.np = __import__('numpy')
+        self.json = __import__('json')
+        self.os = __import__('os')
+        self.skipFactorX, self.skipFactorY = max(1, int(skipFactorX)), max(1, int(skipFactorY))
+        self.bins = int(bins)
+        self.cacheDir = cacheDir or self.os.path.join(__import__('tempfile').gettempdir(), 'raster-functions-stats')
+
+    def get(self, info, uri=None, tiles=None):
+        S = info.get('statistics', None)
+        if S and all(k in s for s in S for k in ('minimum', 'maximum', 'mean', 'standardDeviation')):
+            return tuple(S), tuple(info.get('histogram', None) or ())
+
+        bandCount, noData = info.get('bandCount', 1), info.get('noData', None)
+        if uri:
+            key = self.key(info, uri)
+            r = self.memo.get(key, None) or self._load(key)
+            if r is None:
+                T = self._readTiles(uri)
+                r = self.compute(T, bandCount, noData) if T is not None else None
+                if r is not None:
+                    self._save(key, r)
+            if r is not None:
+                self.memo[key] = r
+                return r
+
+        # no dataset-wide statistics, sample the given tiles
+        return self.compute(tiles, bandCount, noData) if tiles is not None else None
+
+    def key(self, info, uri=None):
+        identity = {'uri': uri, 'skipFactorX': self.skipFactorX, 'skipFactorY': self.skipFactorY, 'bins': self.bins}
+        try:
+            f = self.os.stat(uri)
+            identity['file'] = (f.st_mtime, f.st_size)      # statistics of a rewritten dataset are stale
+        except (TypeError, ValueError, OSError):
+            pass
+        for k in ('bandCount', 'pixelType', 'noData', 'extent', 'cellSize', 'spatialReference',
+                  'nativeExtent', 'nativeSpatialReference', 'geodataXform'):
+            v = info.get(k, None)
+            identity[k] = v.tolist() if hasattr(v, 'tolist') else v
+        s = self.json.dumps(identity, sort_keys=True, default=str)
+        return __import__('hashlib').sha1(s.encode('utf-8')).hexdigest()
+
+    def compute(self, tiles, bandCount=1, noData=None):
+        np = self.np
+        sx, sy = self.skipFactorX, self.skipFactorY
+        samples = [[] for b in range(bandCount)]
+
+        for tlc, pixels in tiles:
+            p = np.asarray(pixels)
+            p = p.reshape((1,) + p.shape) if p.ndim == 2 else p
+            x0, y0 = (-int(tlc[0])) % sx, (-int(tlc[1])) % sy     # keep samples aligned to the raster's grid
+            for b in range(min(bandCount, p.shape[0])):
+                v = p[b, y0::sy, x0::sx].ravel()
+                if noData is not None and len(noData) > b:
+                    v = v[v != noData[b]]
+                if v.size:
+                    samples[b].append(v.astype('f8'))
+
+        S, H = [], []
+        for b in range(bandCount):
+            if not len(samples[b]):
+                return None
+            v = np.concatenate(samples[b])
+            vMin, vMax = float(v.min()), float(v.max())
+            S.append({'minimum': vMin,
+                      'maximum': vMax,
+                      'mean': float(v.mean()),
+                      'standardDeviation': float(v.std()),
+                      'skipFactorX': sx,
+                      'skipFactorY': sy})
+            H.append(np.histogram(v, bins=self.bins, range=(vMin, vMax if vMax > vMin else vMin + 1.))[0])
+        return tuple(S), tuple(H)
+
+    def _readTiles(self, uri, tileRows=512):
+        return readRasterTiles(uri, tileRows, self.skipFactorY)    # tiles keep samples aligned to the raster's grid
+
+    def _path(self, key):
+        return self.os.path.join(self.cacheDir, key + '.json')
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as f:
+                J = self.json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return tuple(J['statistics']), tuple(self.np.array(h) for h in J['histogram'])
+
+    def _save(self, key, r):
+        try:
+            if not self.os.path.isdir(self.cacheDir):
+                self.os.makedirs(self.cacheDir)
+            with open(self._path(key), 'w') as f:
+                self.json.dump({'statistics': list(r[0]), 'histogram': [h.tolist() for h in r[1]]}, f)
+        except (IOError, OSError):
+            pass                # the cache is an optimization, failing to persist it is not an error
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
+
 class ZonalAttributesTable():
-    def __init__(self, tableUri, idField=None, attribList=None):
+    """Queries attributes of zones from a local table or a feature service.
+
+       Rows found for zone IDs are cached--keyed by where clause, query mode, and zone ID--for ttl seconds, and at most
+       cacheSize zones are held, evicting the least recently used. Zone IDs found missing from the table by a query that
+       isn't spatially filtered are cached too, so they aren't queried again until they expire. A query only fetches the zone IDs missing from the cache.
+       Call invalidate() when the table changes.
+
+       With firstRowOnly, at most one row--the first in table order--is returned per zone, and fetching stops as soon
+       as every requested zone has a row: a local table's cursor is cut off, and a feature service is asked for a single
+       record (resultRecordCount) when the query isn't by zone, or not asked for further pages otherwise.
+
+       Feature services are queried over a pool of at most maxConnections keep-alive connections, in concurrent
+       batches of at most batchSize zone IDs, following the service's paging of results larger than its maxRecordCount.
+       Their features are filtered by the extent only when the query isn't by zone ID: the zones of a tile are known
+       from its pixels, and their rows--cached across tiles--don't depend on its extent.
+    """
+
+    def __init__(self, tableUri, idField=None, attribList=None, cacheSize=10000, ttl=300., batchSize=500, maxConnections=4):
         if tableUri is None:
             raise Exception("TODO");
 
@@ -176,39 +489,182 @@ class ZonalAttributesTable():
          
         self.fieldCSV = ",".join(self.queryFields)
 
+        # columns of queryArray(): zone ID and attributes, named after their fields where possible
+        names = ['id']
+        for k, a in enumerate(self.attribList):
+            names.append(a if a and a not in names else 'f{0}'.format(k))
+        self.arrayType = [(n, 'f8') for n in names]
+
         self.arcpy = None
         self.queryUrl = None    # indicator of remote URL vs local table
         s = tableUri.lower()
         if s.startswith('http://') or s.startswith('https://'):
             self.queryUrl = tableUri + ('/query' if tableUri[-1] != '/' else 'query')
-            self.urllib = __import__('urllib')
             self.json = __import__('json')
+            self.urlparse = __import__('urllib.parse', fromlist=['urlencode'])
+            self.http = __import__('http.client', fromlist=['HTTPConnection'])
+            self.queue = __import__('queue')
+            self.connections = self.queue.LifoQueue()    # idle keep-alive connections to the service
+            self.executor = None
+            self.batchSize = batchSize
+            self.maxConnections = maxConnections
+
+        self.np = __import__('numpy')
+        self.time = __import__('time')
+        self.cache = __import__('collections').OrderedDict()     # (where, firstRowOnly, zoneId) -> (expiry time, rows or None if missing)
+        self.cacheSize = cacheSize
+        self.ttl = ttl
+
+    def query(self, idList=[], where=None, extent=None, sr=None, firstRowOnly=False):
+        if self.arcpy is None:
+            self.arcpy = __import__('arcpy')
+
+        if not self.idField or idList is None or not len(idList) or not self.cacheSize:
+            return self._query(idList, where, extent, sr, firstRowOnly)
+
+        now = self.time.time()
+        T, missing = {}, []
+        for zoneId in idList:
+            zoneId = zoneId.item() if hasattr(zoneId, 'item') else zoneId   # numpy scalar
+            key = (where, firstRowOnly, zoneId)
+            e = self.cache.get(key, None)
+            if e is not None and e[0] > now:
+                self.cache.move_to_end(key)
+                if e[1] is not None:                # None: zone is known to be missing from the table
+                    T[zoneId] = e[1]
+            else:
+                missing.append(zoneId)
+
+        if len(missing):
+            expiry = now + self.ttl
+            R = self._query(missing, where, extent, sr, firstRowOnly)
+            for zoneId, rows in R.items():
+                self._cacheRows((where, firstRowOnly, zoneId), rows, expiry)
+                T[zoneId] = rows
+            if self._spatialFilter(missing, extent, sr)[0] is None:     # else missing only means outside the extent
+                for zoneId in missing:
+                    if zoneId not in R:
+                        self._cacheRows((where, firstRowOnly, zoneId), None, expiry)
+        return T
 
-    def query(self, idList=[], where=None, extent=None, sr=None):
+    def queryArray(self, idList=[], where=None, extent=None, sr=None, firstRowOnly=False):
+        """Returns the queried rows in columnar form, as (ids, offsets, A): A is a structured array sorted by zone ID
+           with an 'id' field followed by a float64 field for each attribute--NaN if null or unspecified--and the
+           rows of zone ids[k] are A[offsets[k]:offsets[k+1]], in table order.
+
+           Local tables are read in bulk, bypassing the cache--except for a first row only query that isn't by zone,
+           which reads a single row. Feature services are queried through the cache.
+        """
         if self.arcpy is None:
             self.arcpy = __import__('arcpy')
-        w = self._constructWhereClause(idList, where)
-        if not self.queryUrl:
-            return self._queryTable(w)
+
+        np = self.np
+        if self.queryUrl:
+            A = self._toArray(self.query(idList, where, extent, sr, firstRowOnly))
+        elif firstRowOnly and not self.idField:
+            A = self._toArray(self._queryTable(self._constructWhereClause(idList, where), True))
         else:
-            return self._queryFeatureService(w, extent, sr)
+            A = self._queryTableArray(self._constructWhereClause(idList, where))
+
+        A = A.take(np.argsort(A['id'], kind='stable'))
+        ids, starts = np.unique(A['id'], return_index=True)
+        if firstRowOnly and len(ids) < len(A):
+            A, starts = A.take(starts), np.arange(len(ids))
+        return ids, np.append(starts, len(A)), A
+
+    def invalidate(self, idList=None):
+        """Drops cached rows of the specified zone IDs, or of all zones if idList is None."""
+        if idList is None:
+            self.cache.clear()
+            return
+        I = set(z.item() if hasattr(z, 'item') else z for z in idList)
+        for key in [key for key in self.cache if key[-1] in I]:
+            del self.cache[key]
+
+    def _query(self, idList, where, extent, sr, firstRowOnly=False):
+        if not self.queryUrl:
+            return self._queryTable(self._constructWhereClause(idList, where), firstRowOnly, idList)
+
+        p = self._serviceParameters(*self._spatialFilter(idList, extent, sr))
+        if firstRowOnly and not self.idField:
+            p.update({'resultRecordCount': 1})          # a single row is all we need
+
+        if not self.idField or idList is None or len(idList) <= self.batchSize:
+            return self._queryFeatureService(self._constructWhereClause(idList, where), p, firstRowOnly, idList)
+
+        # query batches of zone IDs concurrently
+        if self.executor is None:
+            self.executor = __import__('concurrent.futures', fromlist=['ThreadPoolExecutor']).ThreadPoolExecutor(self.maxConnections)
+        batches = [idList[i:i+self.batchSize] for i in range(0, len(idList), self.batchSize)]
+
+        T = {}
+        query = lambda b: self._queryFeatureService(self._constructWhereClause(b, where), p, firstRowOnly, b)
+        for R in self.executor.map(query, batches):
+            T.update(R)         # batches don't share zone IDs
+        return T
+
+    def _spatialFilter(self, idList, extent, sr):
+        """Returns the (extent, sr) to filter features by, or (None, None) for a query by zone ID."""
+        if self.idField and idList is not None and len(idList):
+            return None, None
+        return extent, sr
+
+    def _cacheRows(self, key, rows, expiry):
+        self.cache[key] = (expiry, rows)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)      # evict the least recently used zone
 
-    def _queryTable(self, where=None):
+    def _queryTable(self, where=None, firstRowOnly=False, idList=None):
         T = {}
+        if not self.idField:
+            zoneCount = 1
+        elif idList is not None and len(idList):
+            zoneCount = len(set(z.item() if hasattr(z, 'item') else z for z in idList))
+        else:
+            zoneCount = None
         with self.arcpy.da.SearchCursor(self.tableUri, self.queryFields, where_clause=where) as cursor:
             for row in cursor:
+                zoneId = row[self.idFI] if self.idFI is not None else None
+                if firstRowOnly and zoneId in T:
+                    continue
                 I = []
                 for k in range(self.tupleSize):
                     I.append(row[self.fi[k]] if self.fi[k] is not None else None)
-                self._addAttributes(T, row[self.idFI] if self.idFI is not None else None, tuple(I))
+                self._addAttributes(T, zoneId, tuple(I))
+                if firstRowOnly and zoneCount is not None and len(T) >= zoneCount:
+                    break           # every zone has its row, cut the cursor off
         return T
 
-    def _queryFeatureService(self, where=None, extent=None, sr=None):
+    def _queryTableArray(self, where=None):
+        np = self.np
+        sentinel = np.iinfo('i4').min           # stands for null in non floating-point fields
+        types = {f.name.lower(): f.type for f in self.arcpy.ListFields(self.tableUri)}
+        nulls = {f: (np.nan if types.get(f.lower(), None) in ('Double', 'Single') else sentinel) for f in self.queryFields}
+        R = self.arcpy.da.TableToNumPyArray(self.tableUri, self.queryFields, where_clause=where, null_value=nulls)
+
+        A = np.full(len(R), np.nan, dtype=self.arrayType)
+        names = A.dtype.names
+        if self.idFI is not None:
+            A['id'] = R[R.dtype.names[self.idFI]]
+        for k in range(self.tupleSize):
+            if self.fi[k] is not None:
+                A[names[k+1]] = R[R.dtype.names[self.fi[k]]]
+        for n in names:
+            A[n][A[n] == sentinel] = np.nan
+        return A
+
+    def _toArray(self, T):
+        nan = self.np.nan
+        rows = [(nan if zoneId is None else zoneId,) + tuple(nan if v is None else v for v in r)
+                for zoneId, R in (T or {}).items() for r in R]
+        return self.np.array(rows, dtype=self.arrayType)
+
+    def _serviceParameters(self, extent=None, sr=None):
         p = {'f': 'json', 'returnGeometry': 'false'}
         p.update({'outFields': self.fieldCSV})
-        
-        if where and len(where): 
-            p.update({'where': where})
+        if self.idField:
+            p.update({'orderByFields': self.idField})     # stable order across pages
 
         if extent and len(extent) == 4 and sr:
             _sr = sr
@@ -217,31 +673,77 @@ class ZonalAttributesTable():
                 _sr.loadFromString(str(sr))
 
             if _sr.factoryCode > 0:
-                p.update({'inSR': {'latestWkid': _sr.factoryCode}})
+                p.update({'inSR': self.json.dumps({'latestWkid': _sr.factoryCode})})
             else:
-                p.update({'inSR': {'wkt': _sr.exportToString()}})
+                p.update({'inSR': self.json.dumps({'wkt': _sr.exportToString()})})
 
             p.update({'geometryType': 'esriGeometryEnvelope',
-                      'geometry': {'xmin': extent[0], 
-                                   'ymin': extent[1],
-                                   'xmax': extent[2],
-                                   'ymax': extent[3]},
+                      'geometry': self.json.dumps({'xmin': extent[0],
+                                                   'ymin': extent[1],
+                                                   'xmax': extent[2],
+                                                   'ymax': extent[3]}),
                       'spatialRel': 'esriSpatialRelEnvelopeIntersects'})
+        return p
 
-        T = {}
-        r = self.urllib.urlopen(self.queryUrl, self.urllib.urlencode(p)).read()
+    def _queryFeatureService(self, where=None, parameters=None, firstRowOnly=False, idList=None):
+        p = dict(parameters or self._serviceParameters())
+        if where and len(where):
+            p.update({'where': where})
+
+        # features come ordered by zone ID, so the rows of all queried zones are in once the last one is reached
+        lastZone = max(idList) if self.idField and idList is not None and len(idList) else None
 
-        responseJO = self.json.loads(r)
-        featuresJA = responseJO.get('features', None)
-        if featuresJA is not None:
+        T = {}
+        while True:
+            responseJO = self._post(p)
+            featuresJA = responseJO.get('features', None) or []
+            pageLastZone = None                         # zone ID of the last feature of this page
             for featureJO in featuresJA:
                 attrJO = featureJO.get('attributes', None)
                 if attrJO is not None:
                     A = []
                     for z in self.attribList:
                         A = A + [attrJO.get(z, None)]
-                    self._addAttributes(T, attrJO.get(self.idField, None), tuple(A))
-        return T
+                    zoneId = attrJO.get(self.idField, None)
+                    if not firstRowOnly or zoneId not in T:
+                        self._addAttributes(T, zoneId, tuple(A))
+                    pageLastZone = zoneId
+
+            if not responseJO.get('exceededTransferLimit', False) or not len(featuresJA):
+                return T
+            if firstRowOnly and (not self.idField or (lastZone is not None and pageLastZone is not None and pageLastZone >= lastZone)):
+                return T        # every zone has its row, skip the remaining pages
+            p['resultOffset'] = p.get('resultOffset', 0) + len(featuresJA)     # fetch the next page
+
+    def _post(self, parameters):
+        body = self.urlparse.urlencode(parameters)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Connection': 'keep-alive'}
+        u = self.urlparse.urlsplit(self.queryUrl)
+
+        for retry in (False, True):
+            try:
+                c = self.connections.get_nowait()
+            except self.queue.Empty:
+                c = (self.http.HTTPSConnection if u.scheme == 'https' else self.http.HTTPConnection)(u.netloc, timeout=60)
+
+            try:
+                c.request('POST', u.path, body, headers)
+                r = c.getresponse()
+                if r.status != 200:
+                    r.read()
+                    c.close()                           # don't hand a failed exchange back to the pool
+                    raise Exception("Query failed with HTTP status {0} {1}: {2}".format(r.status, r.reason, self.queryUrl))
+                responseJO = self.json.load(r)          # reads the whole body, then decodes it
+            except (self.http.HTTPException, OSError):
+                c.close()                               # the service may have closed an idle connection, retry once
+                if retry:
+                    raise
+                continue
+
+            self.connections.put(c)
+            if 'error' in responseJO:
+                raise Exception("Query failed: {0}".format(responseJO['error'].get('message', responseJO['error'])))
+            return responseJO
 
     def _constructWhereClause(self, idList=[], where=None):
         w1 = "( " + where + " )" if where and len(where) else None
@@ -255,4 +757,240 @@ class ZonalAttributesTable():
                                   w2 if w2 else "")
 
     def _addAttributes(self, T, zoneId, attribValues):
-        T[zoneId] = T.get(zoneId, []) + [attribValues]
+        T.setdefault(zoneId, []).append(attribValues)
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
+
+class ChunkedRasterStore():
+    """A raster stored outside the host, for batch runs and testing: a directory of chunks--NumPy .npy files of
+       (bands, rows, cols) pixels--and a JSON header with its raster information (bandCount, pixelType, noData,
+       cellSize, extent, spatialReference, width, and height) and chunk layout.
+
+       Chunks are memory-mapped. Each holds chunkSize pixels surrounded by a border of padding pixels duplicated
+       from its neighbours, so reading a block that lies in one chunk--padded by at most that many pixels--returns
+       a view of the mapped file, without a copy. Other blocks are assembled from the chunks they overlap.
+       Pixels outside the raster, or never written, read as NoData and are masked out.
+
+       Use create() for a new store, and ChunkedRasterStore(path) to open an existing one--read-only by default.
+    """
+
+    headerName = 'header.json'
+
+    def __init__(self, path, mode='r'):
+        self.np = __import__('numpy')
+        self.os = __import__('os')
+        self.json = __import__('json')
+        self.path = path
+        self.mode = 'r+' if mode in ('r+', 'w') else 'r'
+
+        with open(self.os.path.join(path, self.headerName)) as f:
+            self.header = self.json.load(f)
+
+        H = self.header
+        self.bandCount, self.pixelType = int(H['bandCount']), H['pixelType']
+        self.width, self.height = int(H['width']), int(H['height'])
+        self.chunkRows, self.chunkCols = (int(k) for k in H['chunkSize'])
+        self.padding = int(H.get('padding', 0))
+        noData = H.get('noData', None)
+        self.noData = self.np.zeros(self.bandCount, dtype=self.pixelType) if noData is None else \
+                      self.np.broadcast_to(self.np.asarray(noData, dtype=self.pixelType), (self.bandCount,)).copy()
+        self.chunks = {}        # (chunk row, chunk column) -> memory-mapped pixels
+
+    @classmethod
+    def create(cls, path, info, chunkSize=(512, 512), padding=1):
+        """Creates an empty store of a raster described by info--keyed like raster_info, with width and height
+           unless they follow from extent and cellSize--and returns it open for writing."""
+        e, c = info.get('extent', None), info.get('cellSize', None)
+        w, h = info.get('width', None), info.get('height', None)
+        if (w is None or h is None) and e is not None and c is not None:
+            w, h = int(round((e[2]-e[0])/c[0])), int(round((e[3]-e[1])/c[1]))
+        if w is None or h is None:
+            raise Exception("The raster's width and height, or extent and cell size, are required.")
+        if e is not None and c is None:
+            c = ((e[2]-e[0])/w, (e[3]-e[1])/h)
+
+        sr = info.get('spatialReference', None)
+        noData = info.get('noData', None)
+        header = {
+            'bandCount': int(info.get('bandCount', 1)),
+            'pixelType': info.get('pixelType', 'f4'),
+            'noData': None if noData is None else [float(v) for v in __import__('numpy').ravel(noData)],
+            'cellSize': None if c is None else [float(v) for v in c],
+            'extent': None if e is None else [float(v) for v in e],
+            'spatialReference': sr.exportToString() if hasattr(sr, 'exportToString') else sr,
+            'width': int(w),
+            'height': int(h),
+            'chunkSize': [int(k) for k in chunkSize],
+            'padding': int(padding),
+        }
+
+        os = __import__('os')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, cls.headerName), 'w') as f:
+            __import__('json').dump(header, f, indent=2)
+        return cls(path, 'r+')
+
+    def info(self):
+        """Returns the raster information, keyed like raster_info."""
+        H = self.header
+        return {
+            'bandCount': self.bandCount,
+            'pixelType': self.pixelType,
+            'noData': self.noData.copy() if H.get('noData', None) is not None else None,
+            'cellSize': tuple(H['cellSize']) if H.get('cellSize', None) else None,
+            'extent': tuple(H['extent']) if H.get('extent', None) else None,
+            'spatialReference': H.get('spatialReference', None),
+        }
+
+    def props(self):
+        """Returns the raster properties passed to updatePixels() of a function reading this raster."""
+        props = self.info()
+        props.update({'width': self.width, 'height': self.height})
+        return props
+
+    def blocks(self):
+        """Yields the (tlc, shape) of each chunk of the raster, the blocks that read() serves without a copy."""
+        for y in range(0, self.height, self.chunkRows):
+            for x in range(0, self.width, self.chunkCols):
+                yield (x, y), (self.bandCount, min(self.chunkRows, self.height - y), min(self.chunkCols, self.width - x))
+
+    def read(self, tlc, shape, padding=0):
+        """Returns the (pixels, mask) of the block of the specified shape at tlc, with padding pixels on each side."""
+        np = self.np
+        nRows, nCols = shape[-2:]
+        x0, y0 = tlc[0] - padding, tlc[1] - padding
+        x1, y1 = tlc[0] + nCols + padding, tlc[1] + nRows + padding
+
+        i, j = tlc[1] // self.chunkRows, tlc[0] // self.chunkCols
+        top, left = i * self.chunkRows - self.padding, j * self.chunkCols - self.padding
+        if top <= y0 and y1 <= top + self.chunkRows + 2*self.padding and \
+           left <= x0 and x1 <= left + self.chunkCols + 2*self.padding:
+            C = self._chunk(i, j)
+            if C is not None:
+                pixels = C[:, y0-top:y1-top, x0-left:x1-left]      # a view of the mapped chunk
+                return pixels, self._mask(pixels)
+
+        pixels = np.empty((self.bandCount, y1 - y0, x1 - x0), dtype=self.pixelType)
+        pixels[:] = self.noData.reshape((-1, 1, 1))
+        for i, j, (r0, r1, c0, c1) in self._overlaps(x0, y0, x1, y1, 0):
+            C = self._chunk(i, j)
+            if C is not None:
+                top, left = i * self.chunkRows - self.padding, j * self.chunkCols - self.padding
+                pixels[:, r0-y0:r1-y0, c0-x0:c1-x0] = C[:, r0-top:r1-top, c0-left:c1-left]
+        return pixels, self._mask(pixels)
+
+    def write(self, tlc, pixels, mask=None):
+        """Writes a block of pixels at tlc--NoData where mask is zero--into every chunk, and chunk border, it overlaps."""
+        if self.mode != 'r+':
+            raise Exception("The raster store at {0} is open for reading only.".format(self.path))
+
+        np = self.np
+        pixels = np.asarray(pixels)
+        pixels = pixels.reshape((-1,) + pixels.shape[-2:])
+        if mask is not None:
+            pixels = np.where(np.asarray(mask) != 0, pixels, self.noData.reshape((-1, 1, 1)))
+
+        x0, y0 = tlc
+        x1, y1 = x0 + pixels.shape[-1], y0 + pixels.shape[-2]
+        for i, j, (r0, r1, c0, c1) in self._overlaps(x0, y0, x1, y1, self.padding):
+            C = self._chunk(i, j, create=True)
+            top, left = i * self.chunkRows - self.padding, j * self.chunkCols - self.padding
+            np.copyto(C[:, r0-top:r1-top, c0-left:c1-left], pixels[:, r0-y0:r1-y0, c0-x0:c1-x0], casting='unsafe')
+
+    def flush(self):
+        for C in self.chunks.values():
+            if hasattr(C, 'flush'):
+                C.flush()
+
+    def _overlaps(self, x0, y0, x1, y1, padding):
+        """Yields (i, j, (r0, r1, c0, c1)): chunks of the raster whose pixels--extended by padding--intersect
+           the window, and the rows and columns of the intersection, within the raster."""
+        y0, y1 = max(y0, 0), min(y1, self.height)
+        x0, x1 = max(x0, 0), min(x1, self.width)
+        if y0 >= y1 or x0 >= x1:
+            return
+        nI, nJ = -(-self.height // self.chunkRows), -(-self.width // self.chunkCols)
+        for i in range(max(0, (y0 - padding) // self.chunkRows), min(nI, (y1 - 1 + padding) // self.chunkRows + 1)):
+            for j in range(max(0, (x0 - padding) // self.chunkCols), min(nJ, (x1 - 1 + padding) // self.chunkCols + 1)):
+                top, left = i * self.chunkRows - padding, j * self.chunkCols - padding
+                r0, r1 = max(y0, top), min(y1, top + self.chunkRows + 2*padding)
+                c0, c1 = max(x0, left), min(x1, left + self.chunkCols + 2*padding)
+                if r0 < r1 and c0 < c1:
+                    yield i, j, (r0, r1, c0, c1)
+
+    def _chunk(self, i, j, create=False):
+        C = self.chunks.get((i, j), None)
+        if C is not None:
+            return C
+
+        p = self.os.path.join(self.path, 'r{0}_c{1}.npy'.format(i, j))
+        if self.os.path.exists(p):
+            C = self.np.load(p, mmap_mode=self.mode)
+        elif create:
+            shape = (self.bandCount, self.chunkRows + 2*self.padding, self.chunkCols + 2*self.padding)
+            C = self.np.lib.format.open_memmap(p, mode='w+', dtype=self.pixelType, shape=shape)
+            C[:] = self.noData.reshape((-1, 1, 1))
+        else:
+            return None
+        self.chunks[(i, j)] = C
+        return C
+
+    def _mask(self, pixels):
+        noData = self.noData.reshape((-1, 1, 1))
+        if pixels.dtype.kind == 'f' and self.np.isnan(noData).any():
+            mask = ~self.np.isnan(pixels)
+            mask &= self.np.isnan(noData) | (pixels != noData)
+        else:
+            mask = pixels != noData
+        return mask.astype('u1')
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
+
+def runRasterFunction(function, rasters, path, chunkSize=(512, 512), **scalars):
+    """Runs a Python raster function outside the host: reads its input rasters--a ChunkedRasterStore, or a tuple of
+       them for a parameter of type rasters, keyed by parameter name--block by block, and writes its output into a new
+       ChunkedRasterStore at path, which is returned. Scalar parameters default to their values in getParameterInfo().
+
+       The configuration's padding and inputMask are honored. The output is on the grid of the first input raster,
+       which all inputs must share, and key metadata isn't available.
+    """
+    kwargs = {}
+    for p in function.getParameterInfo() if hasattr(function, 'getParameterInfo') else ():
+        if p.get('dataType', None) not in ('raster', 'rasters'):
+            kwargs[p['name']] = p.get('value', None)
+    kwargs.update(scalars)
+
+    C = function.getConfiguration(**kwargs) if hasattr(function, 'getConfiguration') else {}
+    padding, inputMask = int(C.get('padding', None) or 0), bool(C.get('inputMask', False))
+
+    stores = {}         # name -> (stores, whether the parameter is of type rasters)
+    for name, r in rasters.items():
+        kwargs[name + '_info'] = None                   # an optional raster that isn't specified
+        if r is not None:
+            stores[name] = (tuple(r), True) if isinstance(r, (tuple, list)) else ((r,), False)
+            kwargs[name + '_info'] = tuple(s.info() for s in stores[name][0]) if stores[name][1] else r.info()
+    if not any(len(R) for R, many in stores.values()):
+        raise Exception("At least one input raster is required.")
+    first = next(R[0] for R, many in stores.values() if len(R))
+
+    kwargs['output_info'] = dict(first.info(), width=first.width, height=first.height)    # inherited from the first input
+    if hasattr(function, 'updateRasterInfo'):
+        kwargs = function.updateRasterInfo(**kwargs) or kwargs
+    out = ChunkedRasterStore.create(path, kwargs['output_info'], chunkSize, padding=0)
+
+    props = out.props()
+    for tlc, shape in out.blocks():
+        pixelBlocks = {}
+        for name, (R, many) in stores.items():
+            B = [r.read(tlc, shape, padding) for r in R]
+            pixelBlocks[name + '_pixels'] = tuple(b[0] for b in B) if many else B[0][0]
+            if inputMask:
+                pixelBlocks[name + '_mask'] = tuple(b[1] for b in B) if many else B[0][1]
+
+        pixelBlocks = function.updatePixels(tlc, shape, dict(props), **pixelBlocks)
+        out.write(tlc, pixelBlocks['output_pixels'], pixelBlocks.get('output_mask', None))
+    out.flush()
+    return out
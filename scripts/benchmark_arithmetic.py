@@ -0,0 +1,43 @@
+"""Times Arithmetic on u1, u2, i2 and f4 blocks against computing in float32 and casting to the output type.
+
+Usage: python scripts/benchmark_arithmetic.py [size] [repeat]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'functions'))
+from Arithmetic import Arithmetic
+
+
+def randomBlock(rng, pixelType, shape):
+    if pixelType[0] == 'f':
+        return rng.normal(0., 100., shape).astype(pixelType)
+    i = np.iinfo(pixelType)
+    return rng.integers(i.min, int(i.max) + 1, shape, dtype=pixelType)
+
+
+def main(size=2048, repeat=5):
+    rng = np.random.default_rng(0)
+    print("{0}x{0} blocks, best of {1}".format(size, repeat))
+    for pixelType in ('u1', 'u2', 'i2', 'f4'):
+        r1, r2 = randomBlock(rng, pixelType, (1, size, size)), randomBlock(rng, pixelType, (1, size, size))
+        for op in ('Add', 'Subtract', 'Multiply', 'Divide'):
+            f = Arithmetic()
+            kwargs = f.updateRasterInfo(r1_info={'pixelType': pixelType}, r2_info={'pixelType': pixelType}, op=op, output_info={})
+            props = {'pixelType': kwargs['output_info']['pixelType']}
+
+            def float32():
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    return f.op(np.asarray(r1, 'f4'), np.asarray(r2, 'f4')).astype(props['pixelType'], copy=False)
+
+            new = min(timeit.repeat(lambda: f.updatePixels(None, None, props, r1_pixels=r1, r2_pixels=r2), number=1, repeat=repeat))
+            old = min(timeit.repeat(float32, number=1, repeat=repeat))
+            print("{0} {1:8s} -> {2}  {3:8.2f} ms   float32 {4:8.2f} ms   {5:5.2f}x".format(
+                pixelType, op, props['pixelType'], new * 1e3, old * 1e3, old / new))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
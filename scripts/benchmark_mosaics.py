@@ -0,0 +1,56 @@
+"""Times BasicChuckClose and BasicCubism on a large DEM block against the per-square loops they replaced.
+
+Usage: python scripts/benchmark_mosaics.py [size] [repeat]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'functions'))
+from BasicChuckClose import BasicChuckClose
+from BasicCubism import BasicCubism
+
+
+def chuckCloseLoops(dem, square_size=13, classes=7):
+    # one np.mean() and one slice assignment per square, like BasicChuckClose before it was vectorized
+    out = np.zeros(dem.shape)
+    lo, hi = dem.min(), dem.max()
+    breaks = lo + np.arange(classes) * (hi - lo) / (classes - 1)
+    k = square_size
+    for i in range(dem.shape[1] // k):
+        for j in range(dem.shape[2] // k):
+            b = int(np.searchsorted(breaks, np.mean(dem[0, i*k:(i+1)*k, j*k:(j+1)*k])) // 2)
+            out[0, i*k+b:(i+1)*k-b, j*k+b:(j+1)*k-b] = 1
+    return out.astype('u1')
+
+
+def cubismLoops(dem, square_size=5, pixel_buffer=1):
+    out = np.zeros(dem.shape)
+    k, b = square_size, pixel_buffer
+    for i in range(dem.shape[1] // k):
+        for j in range(dem.shape[2] // k):
+            out[0, i*k+b:(i+1)*k-b, j*k+b:(j+1)*k-b] = np.mean(dem[0, i*k+b:(i+1)*k-b, j*k+b:(j+1)*k-b])
+    return out.astype('f4')
+
+
+def main(size=4096, repeat=3):
+    dem = (np.random.default_rng(0).random((1, size, size)) * 1000.).astype('f4')
+    demInfo = {'bandCount': 1, 'pixelType': 'f4', 'statistics': ({'minimum': 0., 'maximum': 1000.}, )}
+
+    chuckClose = BasicChuckClose()
+    chuckClose.updateRasterInfo(dem=None, dem_info=demInfo, output_info={}, inv=True, show_pix=False)
+    cubism = BasicCubism()
+    cubism.updateRasterInfo(dem=None, dem_info=demInfo, output_info={})
+
+    print("{0}x{0} block, best of {1}".format(size, repeat))
+    for name, f, loops in (("BasicChuckClose", chuckClose, chuckCloseLoops), ("BasicCubism", cubism, cubismLoops)):
+        props = {'pixelType': 'u1' if f is chuckClose else 'f4'}
+        new = min(timeit.repeat(lambda: f.updatePixels((0, 0), dem.shape, props, dem_pixels=dem), number=1, repeat=repeat))
+        old = min(timeit.repeat(lambda: loops(dem), number=1, repeat=1))
+        print("{0:16s} {1:8.1f} ms   per-square loops {2:8.1f} ms   {3:6.1f}x".format(name, new * 1e3, old * 1e3, old / new))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# functions import each other--and utils--as top-level modules, like the Python Adapter does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'functions'))
@@ -0,0 +1,29 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from Arithmetic import Arithmetic
+
+
+references = {'Add': np.add, 'Subtract': np.subtract, 'Multiply': np.multiply, 'Divide': np.divide}
+
+
+@pytest.mark.parametrize('pixelType, op, constant, honorNoData',
+                         list(itertools.product(('u1', 'u2', 'u4'), sorted(references), (-1, -3, -300, -2.5), (False, True))))
+def test_negative_constant_with_unsigned_input(pixelType, op, constant, honorNoData):
+    i = np.iinfo(pixelType)
+    r1 = np.linspace(i.min, i.max, 256).astype(pixelType).reshape((1, 16, 16))
+    mask = np.ones(r1.shape, dtype='u1')
+
+    f = Arithmetic()
+    kwargs = f.updateRasterInfo(r1_info={'pixelType': pixelType}, r2_info=None, constant=constant, op=op,
+                                honorNoData=honorNoData, output_info={})
+    out = f.updatePixels(None, None, {'pixelType': kwargs['output_info']['pixelType']}, r1_pixels=r1, r1_mask=mask)
+
+    expected = references[op](r1.astype('f8'), constant)
+    assert out['output_pixels'].dtype == kwargs['output_info']['pixelType']
+    if out['output_pixels'].dtype.kind == 'f':
+        assert np.allclose(out['output_pixels'], expected, rtol=1e-6)
+    else:
+        assert np.array_equal(out['output_pixels'], expected)      # integer results are exact
@@ -0,0 +1,78 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from BandMath import BandMath
+
+
+def rasters():
+    rng = np.random.default_rng(30)
+    R1 = rng.uniform(0., 1000., (7, 32, 48)).astype('f4')
+    R2 = rng.uniform(0., 1000., (7, 32, 48)).astype('f4')
+    R1[1, :4] = 0.                                      # zeros to divide by
+    R1[0, :2] = 0.
+    return R1, R2
+
+
+def run(expression, R):
+    f = BandMath()
+    f.updateRasterInfo(rasters_info=[{'bandCount': len(r)} for r in R], expression=expression, output_info={})
+    out = f.updatePixels((0, 0), (1,) + R[0].shape[1:], {'pixelType': 'f4'}, rasters_pixels=R)['output_pixels']
+    return f, out
+
+
+cases = [
+    ('(B2 - B1) / (B2 + B1)', lambda R1, R2: (R1[1] - R1[0]) / (R1[1] + R1[0])),
+    ('(R1B4 - R1B7) / (R1B4 + R1B7) - (R2B4 - R2B7) / (R2B4 + R2B7)',
+     lambda R1, R2: (R1[3] - R1[6]) / (R1[3] + R1[6]) - (R2[3] - R2[6]) / (R2[3] + R2[6])),
+    ('(B1 + B2) * (B2 + B1) + sqrt(abs(B1 + B2)) - (B1 + B2) / 2',
+     lambda R1, R2: (R1[0] + R1[1]) * (R1[1] + R1[0]) + np.sqrt(np.abs(R1[0] + R1[1])) - (R1[0] + R1[1]) / np.float32(2)),
+    ('2 * 3 + B1 * (4 - 1) ** 2 - -B3', lambda R1, R2: np.float32(6) + R1[0] * np.float32(9) + R1[2]),
+    ('max(B1, B2) - min(B2, B1) + log10(B3 + 1) * exp(B4 / 1000) + sin(B5) * cos(B5) / tan(B6 + 1)',
+     lambda R1, R2: np.maximum(R1[0], R1[1]) - np.minimum(R1[1], R1[0]) + np.log10(R1[2] + np.float32(1)) * np.exp(R1[3] / np.float32(1000))
+     + np.sin(R1[4]) * np.cos(R1[4]) / np.tan(R1[5] + np.float32(1))),
+    ('B1 / B2 + log(B1)', lambda R1, R2: R1[0] / R1[1] + np.log(R1[0])),      # x/0, 0/0, and log(0)
+    ('B1 ** 0.5 * B1 ** 0.5', lambda R1, R2: R1[0] ** np.float32(0.5) * R1[0] ** np.float32(0.5)),
+]
+
+
+@pytest.mark.parametrize('expression, reference', cases)
+def test_matches_numpy(expression, reference):
+    R = rasters()
+    with np.errstate(all='ignore'):
+        expected = reference(*R)
+    f, out = run(expression, R)
+    assert out.shape == (1,) + expected.shape and out.dtype == np.float32
+    assert np.allclose(out[0], expected, rtol=1e-5, equal_nan=True)
+
+
+def test_repeated_subexpressions_are_computed_once():
+    f, out = run('(B1 + B2) * (B2 + B1) + sqrt(abs(B1 + B2)) - (B1 + B2) / 2', rasters())
+    assert sum(1 for g, operands, d in f.program if g is np.add) == 2         # B1 + B2, and the outer sum
+    assert len(set(operands for g, operands, d in f.program if g is None)) == 2   # each band is loaded once
+
+
+def test_constants_are_folded():
+    f, out = run('2 * 3 + B1 * (4 - 1) ** 2', rasters())
+    assert all(any(isinstance(k, int) for k in operands) for g, operands, d in f.program if g is not None)
+    assert [float(k) for g, operands, d in f.program for k in operands if g is not None and not isinstance(k, int)] == [9., 6.]
+
+    f, out = run('2 * (3 + 1)', rasters())
+    assert f.program == [] and (out == 8.).all()
+
+
+def test_buffers_are_reused():
+    expression = ' + '.join('(B{0} - B{1}) / (B{0} + B{1})'.format(k, k + 1) for k in range(1, 7))
+    f, out = run(expression, rasters())
+    assert f.bufferCount < 6 < len(f.program)
+
+
+def test_floating_point_errors_are_scoped():
+    R = rasters()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with np.errstate(all='raise'):                  # the caller's settings...
+            f, out = run('B1 / B2 + log(B1 - B1) + 1e38 * 1e38 * B3', R)
+            assert np.geterr()['divide'] == 'raise'      # ...are restored
+    assert np.isinf(out).any() or np.isnan(out).any()
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import utils
+from Arithmetic import Arithmetic
+
+
+info = {'bandCount': 2, 'pixelType': 'i2', 'noData': np.array([-1, -1]), 'extent': (0., 0., 130., 150.), 'cellSize': (1., 1.)}
+
+
+def raster():
+    return np.arange(2 * 150 * 130, dtype='i2').reshape((2, 150, 130)) % 1000
+
+
+def store(path, chunkSize=(64, 48), padding=2):
+    s = utils.ChunkedRasterStore.create(str(path), info, chunkSize, padding)
+    R = raster()
+    for y in range(0, 150, 50):                         # blocks that don't line up with the chunks
+        for x in range(0, 130, 70):
+            s.write((x, y), R[:, y:y+50, x:x+70])
+    s.flush()
+    return s
+
+
+def test_round_trip(tmp_path):
+    store(tmp_path)
+    s = utils.ChunkedRasterStore(str(tmp_path))
+    assert (s.width, s.height, s.bandCount, s.pixelType) == (130, 150, 2, 'i2')
+    assert s.info()['extent'] == info['extent']
+
+    pixels, mask = s.read((0, 0), (2, 150, 130))
+    assert np.array_equal(pixels, raster()) and mask.all()
+    with pytest.raises(Exception, match='reading only'):
+        s.write((0, 0), raster())
+
+
+def test_edge_blocks(tmp_path):
+    s = store(tmp_path)
+    blocks = list(s.blocks())
+    assert len(blocks) == 3 * 3
+    assert blocks[-1] == ((96, 128), (2, 22, 34))       # truncated to the raster
+    assert sum(shape[1] * shape[2] for tlc, shape in blocks) == 150 * 130
+
+    # a block hanging off the raster reads NoData there
+    pixels, mask = s.read((120, 140), (2, 20, 20))
+    assert np.array_equal(pixels[:, :10, :10], raster()[:, 140:, 120:])
+    assert (pixels[:, 10:] == -1).all() and (pixels[:, :, 10:] == -1).all()
+    assert mask[:, :10, :10].all() and not mask[:, 10:].any() and not mask[:, :, 10:].any()
+
+
+def test_padded_read(tmp_path):
+    s = store(tmp_path)
+    R = np.pad(raster(), ((0, 0), (3, 3), (3, 3)), constant_values=-1)
+    for tlc, shape in s.blocks():
+        x, y = tlc
+        for padding in (0, 2, 3):                       # within the chunks' border, and beyond it
+            pixels, mask = s.read(tlc, shape, padding)
+            expected = R[:, y+3-padding:y+3+shape[1]+padding, x+3-padding:x+3+shape[2]+padding]
+            assert np.array_equal(pixels, expected)
+            assert np.array_equal(mask, (expected != -1).astype('u1'))
+            if padding <= 2:
+                assert isinstance(pixels, np.memmap)    # a view of the mapped chunk
+
+
+def test_unwritten_chunks_read_nodata(tmp_path):
+    s = utils.ChunkedRasterStore.create(str(tmp_path), dict(info, pixelType='f4', noData=np.array([np.nan, np.nan])), (64, 64))
+    s.write((0, 0), np.ones((2, 10, 10), 'f4'), mask=np.eye(10, dtype='u1')[None].repeat(2, 0))
+    pixels, mask = s.read((0, 0), (2, 100, 100))
+    assert np.array_equal(mask[:, :10, :10], np.eye(10, dtype='u1')[None].repeat(2, 0))
+    assert not mask[:, 10:].any() and np.isnan(pixels[:, 10:]).all()
+
+
+class BoxMean():
+    """Mean of each pixel's 3x3 neighbourhood, needing one pixel of padding."""
+
+    def getParameterInfo(self):
+        return [{'name': 'raster', 'dataType': 'raster', 'value': None}]
+
+    def getConfiguration(self, **scalars):
+        return {'padding': 1, 'inputMask': True}
+
+    def updateRasterInfo(self, **kwargs):
+        kwargs['output_info']['pixelType'] = 'f4'
+        return kwargs
+
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        p, m = pixelBlocks['raster_pixels'].astype('f8'), pixelBlocks['raster_mask']
+        rows, cols = shape[-2:]
+        S = sum(p[:, i:i+rows, j:j+cols] for i in range(3) for j in range(3))
+        pixelBlocks['output_pixels'] = (S / 9.).astype(props['pixelType'])
+        pixelBlocks['output_mask'] = np.all([m[:, i:i+rows, j:j+cols] for i in range(3) for j in range(3)], axis=0).astype('u1')
+        return pixelBlocks
+
+
+def test_run_raster_function(tmp_path):
+    s = store(tmp_path / 'in')
+    out = utils.runRasterFunction(Arithmetic(), {'r1': s, 'r2': None}, str(tmp_path / 'product'), (64, 64), op='Multiply', constant=3)
+    pixels, mask = out.read((0, 0), (2, 150, 130))
+    assert out.pixelType == 'i4' and np.array_equal(pixels, raster() * 3) and mask.all()
+
+    out = utils.runRasterFunction(BoxMean(), {'raster': s}, str(tmp_path / 'mean'), (40, 40))
+    pixels, mask = out.read((0, 0), (2, 150, 130))
+    R = raster().astype('f8')
+    expected = sum(R[:, i:i+148, j:j+128] for i in range(3) for j in range(3)) / 9.
+    assert np.allclose(pixels[:, 1:-1, 1:-1], expected)
+    assert mask[:, 1:-1, 1:-1].all() and not mask[:, 0].any() and not mask[:, :, -1].any()    # padding off the raster is NoData
@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from CriteriaOverlay import CriteriaOverlay
+
+
+@pytest.mark.parametrize('weights, pixelType', [
+    ((1, 1, 1), 'u1'),
+    ((-1, 1), 'i1'),
+    ((-100, -28), 'i1'),
+    ((-100, -29), 'i2'),
+    ((200, 55), 'u1'),
+    ((200, 56), 'u2'),
+    ((-1, 200), 'i2'),
+    ((70000, 1), 'u4'),
+    ((-1, 70000), 'i4'),
+    ((2 ** 31, 2 ** 31), 'f8'),
+    ((0.5, 1), 'f4'),
+])
+def test_narrowest_pixel_type(weights, pixelType):
+    rules = [{'raster': 1, 'min': 0, 'weight': w} for w in weights]
+    kwargs = CriteriaOverlay().updateRasterInfo(rasters_info=[{}], rules=json.dumps(rules), output_info={})
+    assert kwargs['output_info']['pixelType'] == pixelType
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import utils
+
+pytest.importorskip('pyproj')
+
+
+@pytest.fixture
+def proj():
+    return utils.Projection('pyproj')
+
+
+def test_esri_wkid(proj):
+    x, y = np.array([-8238310., 1000.]), np.array([4970072., -2000.])
+    assert np.allclose(proj.transform(102100, 4326, x, y), proj.transform(3857, 4326, x, y))
+    assert proj.isGeographic(4326) and not proj.isGeographic(102100)
+
+
+def test_esri_wkid_fallback(proj, monkeypatch):
+    # older PROJ databases don't resolve Esri WKIDs given as plain numbers
+    CRS, fromUserInput = proj.pyproj.CRS, proj.pyproj.CRS.from_user_input
+
+    def epsgOnly(v, **kwargs):
+        if isinstance(v, int) and v > 100000:
+            raise proj.pyproj.exceptions.CRSError("Invalid projection: epsg:{0}".format(v))
+        return fromUserInput(v, **kwargs)
+
+    monkeypatch.setattr(CRS, 'from_user_input', staticmethod(epsgOnly))
+    assert proj.createSR(102100).to_authority() == ('ESRI', '102100')
+
+
+def test_project_cell_size(proj):
+    assert np.allclose(utils.projectCellSize((0.001, 0.002), 4326, 3857, proj), (0.001 * utils.degreeToMeter, 0.002 * utils.degreeToMeter))
+    assert np.allclose(utils.projectCellSize((30., 30.), 3857, 4326, proj), (30. / utils.degreeToMeter, 30. / utils.degreeToMeter))
+    assert np.allclose(utils.projectCellSize((30., 30.), 102100, 2263, proj), (30. / 0.3048006096, 30. / 0.3048006096))   # US feet
+    assert np.allclose(utils.projectCellSize((1., 1.), 4326, 4326, proj), (1., 1.))
+
+
+def test_compute_cell_size(proj):
+    props = {'extent': (0., 0., 1., 1.), 'width': 100, 'height': 50, 'spatialReference': 4326}
+    dx, dy = utils.computeCellSize(props, 3857, proj)
+    assert np.allclose((dx, dy), (utils.degreeToMeter / 100, utils.degreeToMeter / 50), rtol=1e-3)
@@ -0,0 +1,107 @@
+import sys
+
+import numpy as np
+
+import utils
+from BasicChuckClose import BasicChuckClose, classBreaks
+from BasicCubism import BasicCubism
+from FuzzyMembership import FuzzyMembership
+
+
+noData = -9999.
+demInfo = {'bandCount': 1, 'pixelType': 'f4', 'noData': np.array([noData]), 'statistics': (), 'histogram': ()}
+
+
+def blocks():
+    empty = np.full((1, 64, 64), noData, dtype='f4')
+    valid = np.arange(64 * 64, dtype='f4').reshape((1, 64, 64))
+    return empty, valid
+
+
+def test_compute_of_nodata_only_is_none():
+    empty, valid = blocks()
+    s = utils.RasterStatistics()
+    assert s.get(demInfo, tiles=[((0, 0), empty)]) is None
+    S, H = s.get(demInfo, tiles=[((0, 0), valid)])
+    assert S[0]['minimum'] == 0. and S[0]['maximum'] > 0.
+
+
+def test_tile_samples_are_not_memoized():
+    empty, valid = blocks()
+    utils.RasterStatistics().get(demInfo, tiles=[((0, 0), valid)])
+    assert utils.RasterStatistics().get(demInfo) is None
+
+
+def test_chuck_close_skips_nodata_first_block():
+    empty, valid = blocks()
+    f = BasicChuckClose()
+    f.updateRasterInfo(dem_info=dict(demInfo), inv=True, show_pix=False, square_size=8, classes=4, output_info={})
+    props = {'pixelType': 'u1'}
+
+    out = f.updatePixels((0, 0), (1, 64, 64), props, dem_pixels=empty)['output_pixels']
+    assert not out.any() and f.breaks is None
+
+    out = f.updatePixels((64, 0), (1, 64, 64), props, dem_pixels=valid)['output_pixels']
+    assert f.breaks is not None and out.any()
+
+
+def test_cubism_skips_nodata_first_block():
+    empty, valid = blocks()
+    f = BasicCubism()
+    f.updateRasterInfo(dem_info=dict(demInfo), square_size=8, classes=4, output_info={})
+    props = {'pixelType': 'f4'}
+
+    out = f.updatePixels((0, 0), (1, 64, 64), props, dem_pixels=empty)['output_pixels']
+    assert not out.any() and f.values is None
+
+    out = f.updatePixels((64, 0), (1, 64, 64), props, dem_pixels=valid)['output_pixels']
+    assert f.values is not None and out.any()
+
+
+def test_fuzzy_membership_skips_nodata_first_block():
+    empty, valid = blocks()
+    f = FuzzyMembership()
+    f.updateRasterInfo(raster_info=dict(demInfo), mode='Linear', hedge='None', par1=0., par2=0., output_info={})
+    props = {'pixelType': 'f4'}
+
+    r = f.updatePixels((0, 0), (1, 64, 64), props, raster_pixels=empty)
+    assert not f.ready and not r['output_mask'].any()
+
+    r = f.updatePixels((64, 0), (1, 64, 64), props, raster_pixels=valid)
+    assert f.ready and r['output_pixels'].max() == 1.
+
+
+def test_dataset_pass_precedes_first_block(tmp_path, monkeypatch):
+    dataset = np.arange(256 * 256, dtype='f4').reshape((256, 256))
+    arcpy = type(sys)('arcpy')
+
+    class Raster():
+        def __init__(self, uri):
+            self.width, self.height, self.meanCellHeight = 256, 256, 1.
+            self.extent = type('Extent', (), {'XMin': 0., 'YMax': 256.})
+
+    arcpy.Raster = Raster
+    arcpy.Point = lambda x, y: (x, y)
+    arcpy.RasterToNumPyArray = lambda r, ll, w, n: dataset[int(256 - ll[1] - n):int(256 - ll[1])]
+    monkeypatch.setitem(sys.modules, 'arcpy', arcpy)
+
+    f = BasicChuckClose()
+    f.statistics.cacheDir = str(tmp_path)
+    f.updateRasterInfo(dem=str(tmp_path / 'dem.tif'), dem_info=dict(demInfo), inv=True, show_pix=False,
+                       square_size=8, classes=5, output_info={})
+
+    # breaks span the whole dataset, not just the block requested first
+    expected = classBreaks({'minimum': 0., 'maximum': float(dataset.max())}, 5)
+    assert np.allclose(f.breaks, expected, rtol=0.05)      # within the sampling error
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+def test_sidecar_key_changes_with_the_file(tmp_path):
+    path = tmp_path / 'dem.tif'
+    path.write_bytes(b'\0' * 16)
+    s = utils.RasterStatistics(cacheDir=str(tmp_path))
+    key = s.key(demInfo, str(path))
+    assert s.key(demInfo, str(path)) == key
+
+    path.write_bytes(b'\0' * 32)        # the dataset is rewritten
+    assert s.key(demInfo, str(path)) != key
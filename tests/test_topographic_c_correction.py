@@ -0,0 +1,89 @@
+import sys
+
+import numpy as np
+import pytest
+
+from TopographicCCorrection import TopographicCCorrection, _RegressionSums
+
+
+def test_regression_sums_match_linregress():
+    stats = pytest.importorskip('scipy.stats')
+    rng = np.random.default_rng(47)
+    x = rng.uniform(0., 1., (64, 64)).astype('f4')
+    Y = np.stack([300. * x + 40., 120. * x + 90.]) + rng.normal(0., 5., (2, 64, 64))
+    valid = rng.random((64, 64)) > 0.2
+
+    sums = _RegressionSums(2)
+    for rows in (slice(0, 24), slice(24, 64)):        # accumulated tile by tile
+        sums.add(x[rows], Y[:, rows], valid[rows], skip=2)
+
+    v = valid[::2, ::2]                                 # tiles of even rows keep the same samples
+    for b, C in enumerate(sums.coefficients()):
+        fit = stats.linregress(x[::2, ::2][v].astype('f8'), Y[b, ::2, ::2][v])
+        assert np.isclose(C, fit.intercept / fit.slope)
+
+
+def fakeArcpy(datasets):
+    arcpy = type(sys)('arcpy')
+
+    class Raster():
+        def __init__(self, uri):
+            self.pixels = datasets[uri]
+            self.height, self.width = self.pixels.shape[-2:]
+            self.meanCellHeight = 1.
+            self.extent = type('Extent', (), {'XMin': 0., 'YMax': float(self.height)})
+
+    def toNumPyArray(r, ll, w, n):
+        y1 = int(r.height - ll[1])
+        return r.pixels[..., y1 - n:y1, :w]
+
+    arcpy.Raster = Raster
+    arcpy.Point = lambda x, y: (x, y)
+    arcpy.RasterToNumPyArray = toNumPyArray
+    return arcpy
+
+
+def scene(rows=1200, cols=300):
+    rng = np.random.default_rng(46)
+    slope = rng.uniform(0., 40., (rows, cols)).astype('f4')
+    aspect = rng.uniform(0., 360., (rows, cols)).astype('f4')
+    slope[:100] = -1.                                   # a first block of NoData terrain
+    return slope, aspect
+
+
+def test_coefficients_come_from_the_whole_scene(monkeypatch):
+    slope, aspect = scene()
+    f = TopographicCCorrection()
+    f.sun = [(np.radians(135.), np.radians(40.))]
+    cos_i = f.incidence(0, f.terrainTerms(slope[None], aspect[None]))
+    image = np.stack([200. * cos_i + 50., 80. * cos_i + 120.]).astype('f4')
+
+    datasets = {'scene.tif': image, 'slope.tif': slope, 'aspect.tif': aspect}
+    monkeypatch.setitem(sys.modules, 'arcpy', fakeArcpy(datasets))
+    info = {'bandCount': 2, 'pixelType': 'f4'}
+    f.updateRasterInfo(rasters=['scene.tif'], rasters_info=[info], rasters_keyMetadata=[{'sunazimuth': 135., 'sunelevation': 50.}],
+                       slope='slope.tif', slope_info={'noData': np.array([-1.])}, aspect='aspect.tif', aspect_info={},
+                       output_info={})
+    assert np.allclose(f.C[0], [50. / 200., 120. / 80.], rtol=1e-3)
+
+    # requesting a block--even one without valid terrain--doesn't refit C
+    C = [c.copy() for c in f.C]
+    f.updatePixels((0, 0), (2, 100, 300), {'pixelType': 'f4'}, rasters_pixels=[image[:, :100]],
+                   rasters_mask=[np.ones((2, 100, 300), 'u1')], slope_pixels=slope[None, :100], aspect_pixels=aspect[None, :100],
+                   slope_mask=np.zeros((1, 100, 300), 'u1'), aspect_mask=np.ones((1, 100, 300), 'u1'))
+    assert all(np.array_equal(a, b) for a, b in zip(C, f.C))
+
+
+def test_cached_grids_stay_within_budget():
+    slope, aspect = scene(512, 512)
+    f = TopographicCCorrection()
+    f.sun = [(np.radians(135.), np.radians(40.)), (np.radians(150.), np.radians(30.))]
+    f.cacheBytes = 10 << 20
+    for k in range(8):
+        for s in range(2):
+            f.illuminationGrid(s, ((k * 512, 0), (512, 512), ()), slope[None], aspect[None])
+        assert f.cachedBytes == sum(a.nbytes for v in f.cache.values() for a in (v if isinstance(v, tuple) else (v,)))
+        assert f.cachedBytes <= f.cacheBytes
+
+    # the most recent tile's grids are held: 3 terrain grids and 2 illumination grids of 1 MB each
+    assert ('terrain', ((7 * 512, 0), (512, 512), ())) in f.cache and f.cachedBytes >= 5 << 20
@@ -0,0 +1,81 @@
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+from HeatIndex import HeatIndex
+from Windchill import Windchill
+
+
+temperatureUnits = ('Fahrenheit', 'Celsius', 'Kelvin')
+toFahrenheit = {'F': lambda t: t, 'C': lambda t: 1.8*t + 32., 'K': lambda t: 1.8*t - 459.67}
+fromFahrenheit = {'F': lambda f: f, 'C': lambda f: (f - 32.) / 1.8, 'K': lambda f: (f + 459.67) / 1.8}
+toMPH = {'mph': 1., 'kph': 1. / 1.609344, 'm/s': 3600. / 1609.344, 'ft/s': 5280. / 3600., 'knots': 1.15077945}
+
+
+def windchill(t, ws):
+    # NWS wind chill index, per pixel, in Fahrenheit and mph
+    return 35.74 + 0.6215*t - 35.75*ws**0.16 + 0.4275*t*ws**0.16
+
+
+def heatIndex(t, r):
+    # the original per-pixel heat index (Rothfusz's regression with adjustments), in Fahrenheit
+    hi = 0.5 * (t + 61. + (t - 68.) * 1.2 + r * 0.094)
+    if (hi + t) / 2. <= 80.:
+        return hi
+    hi = (-42.379 + 2.04901523*t + 10.14333127*r - 0.22475541*t*r - 6.83783e-3*t*t - 5.481717e-2*r*r
+          + 1.22874e-3*t*t*r + 8.5282e-4*t*r*r - 1.99e-6*t*t*r*r)
+    if r < 13. and 80. <= t <= 112.:
+        hi -= ((13. - r) / 4.) * math.sqrt((17. - abs(t - 95.)) / 17.)
+    if r > 85. and 80. <= t <= 87.:
+        hi += ((t - 85.) / 10.) * ((87. - t) / 5.)
+    return hi
+
+
+@pytest.mark.parametrize('tunits, wunits, ounits', list(itertools.product(temperatureUnits, sorted(toMPH), temperatureUnits)))
+def test_windchill_units(tunits, wunits, ounits):
+    rng = np.random.default_rng(35)
+    tF = rng.uniform(-40., 50., (1, 16, 16))
+    mph = rng.uniform(3., 60., (1, 16, 16))
+    t = fromFahrenheit[tunits[0]](tF).astype('f4')
+    ws = (mph / toMPH[wunits]).astype('f4')
+
+    f = Windchill()
+    f.updateRasterInfo(tunits=tunits, wunits=wunits, ounits=ounits, output_info={})
+    mask = np.ones((1, 16, 16), dtype='u1')
+    out = f.updatePixels((0, 0), (1, 16, 16), {'pixelType': 'f4'},
+                         temperature_pixels=t, ws_pixels=ws, temperature_mask=mask, ws_mask=mask)['output_pixels']
+
+    # per-pixel reference, from the float32 inputs converted to Fahrenheit and mph
+    T = toFahrenheit[tunits[0]](t.astype('f8'))
+    W = ws.astype('f8') * toMPH[wunits]
+    expected = fromFahrenheit[ounits[0]](windchill(T, W))
+    assert np.allclose(out, expected, atol=2e-3)
+
+
+def test_windchill_knots_are_converted_to_mph():
+    # 10 knots is 11.5 mph: wind speed in knots is multiplied by 1.15077945--it used to be divided
+    f = Windchill()
+    f.updateRasterInfo(tunits='Fahrenheit', wunits='knots', ounits='Fahrenheit', output_info={})
+    mask = np.ones((1, 1, 1), dtype='u1')
+    out = f.updatePixels((0, 0), (1, 1, 1), {'pixelType': 'f4'},
+                         temperature_pixels=np.full((1, 1, 1), 10., 'f4'), ws_pixels=np.full((1, 1, 1), 10., 'f4'),
+                         temperature_mask=mask, ws_mask=mask)['output_pixels']
+    assert abs(out.item() - windchill(10., 11.5077945)) < 1e-3
+
+
+@pytest.mark.parametrize('units, outunits', list(itertools.product(temperatureUnits, temperatureUnits)))
+def test_heat_index_units(units, outunits):
+    rng = np.random.default_rng(35)
+    tF = rng.uniform(60., 115., (1, 32, 32))
+    rh = rng.uniform(0., 100., (1, 32, 32)).astype('f4')
+    t = fromFahrenheit[units[0]](tF).astype('f4')
+
+    f = HeatIndex()
+    f.updateRasterInfo(units=units, outunits=outunits, output_info={})
+    out = f.updatePixels((0, 0), (1, 32, 32), {'pixelType': 'f4'}, temperature_pixels=t, rh_pixels=rh)['output_pixels']
+
+    T = toFahrenheit[units[0]](t.astype('f8').ravel())
+    expected = fromFahrenheit[outunits[0]](np.array([heatIndex(a, b) for a, b in zip(T, rh.astype('f8').ravel())]))
+    assert np.allclose(out.ravel(), expected, atol=0.01)
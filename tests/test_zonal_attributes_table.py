@@ -0,0 +1,152 @@
+import json
+import threading
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+import utils
+
+
+# a feature service's rows: two per zone, with every 7th zone missing. Zone z lies at x = z.
+ROWS = [{'zone': z, 'a': z * 10, 'b': r} for z in range(3000) for r in range(2) if z % 7]
+PAGE = 100      # the service's maxRecordCount
+
+
+class FeatureService(BaseHTTPRequestHandler):
+    """Stand-in for a feature service's query endpoint: filters on 'zone IN (...)' and an envelope, and pages by
+       resultOffset."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        q = dict(urllib.parse.parse_qsl(self.rfile.read(int(self.headers['Content-Length'])).decode()))
+        log = self.server.log
+        with log['lock']:
+            log['requests'] += 1
+            log['connections'].add(self.client_address)
+
+        where, rows, status = q.get('where', ''), ROWS, 200
+        if 'IN (' in where:
+            ids = set(int(float(z)) for z in where.split('IN (')[1].split(')')[0].split(','))
+            with log['lock']:
+                log['maxBatch'] = max(log['maxBatch'], len(ids))
+            rows = [r for r in ROWS if r['zone'] in ids]
+        if 'geometry' in q:
+            e = json.loads(q['geometry'])
+            rows = [r for r in rows if e['xmin'] <= r['zone'] <= e['xmax']]
+        offset = int(q.get('resultOffset', 0))
+        count = min(int(q.get('resultRecordCount', PAGE)), PAGE)
+        page = rows[offset:offset + count]
+        body = {'features': [{'attributes': r} for r in page], 'exceededTransferLimit': offset + len(page) < len(rows)}
+        if 'bare' in where and offset == 0:
+            body['features'] = [{} for r in page]      # features without attributes
+        if 'invalid' in where:
+            body = {'error': {'code': 400, 'message': 'Invalid where clause'}}
+        elif 'unavailable' in where:
+            status, body = 503, {}
+
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    arcpy = types.ModuleType('arcpy')
+
+    class SpatialReference():
+        factoryCode = 0
+
+        def loadFromString(self, s):
+            self.factoryCode = int(s)
+
+    arcpy.SpatialReference = SpatialReference
+    monkeypatch.setitem(__import__('sys').modules, 'arcpy', arcpy)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeatureService)
+    server.log = {'lock': threading.Lock(), 'requests': 0, 'connections': set(), 'maxBatch': 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/FeatureServer/0'.format(server.server_address[1]), server.log
+    server.shutdown()
+    server.server_close()
+
+
+def rowsOf(ids):
+    T = {}
+    for r in ROWS:
+        if r['zone'] in ids:
+            T.setdefault(r['zone'], []).append((r['a'], r['b']))
+    return T
+
+
+def test_batches_over_pooled_connections(service):
+    url, log = service
+    t = utils.ZonalAttributesTable(url, idField='zone', attribList=['a', 'b'], batchSize=200, maxConnections=4)
+    ids = np.arange(2000)
+    assert t.query(ids) == rowsOf(set(range(2000)))
+    assert log['maxBatch'] <= 200
+    assert log['requests'] >= 2000 // 200
+    assert len(log['connections']) <= 4     # keep-alive connections are reused
+
+    n = log['requests']
+    assert t.query(ids) == rowsOf(set(range(2000)))
+    assert log['requests'] == n             # served from the cache
+
+
+def test_pages_by_result_offset(service):
+    url, log = service
+    t = utils.ZonalAttributesTable(url, idField='zone', attribList=['a', 'b'])
+    T = t.query(None)
+    assert sum(len(v) for v in T.values()) == len(ROWS)
+    assert log['requests'] == -(-len(ROWS) // PAGE)
+
+
+def test_first_row_only(service):
+    url, log = service
+    t = utils.ZonalAttributesTable(url, idField='zone', attribList=['a', 'b'])
+    assert t.query(np.array([1., 2., 7., 3.]), firstRowOnly=True) == {1: [(10, 0)], 2: [(20, 0)], 3: [(30, 0)]}
+
+    n = log['requests']
+    assert 7 not in t.query(np.array([1., 2., 7., 3.]), firstRowOnly=True)
+    assert log['requests'] == n             # missing zones are cached too
+
+
+def test_zones_are_not_filtered_by_the_extent_of_the_first_tile(service):
+    url, log = service
+    t = utils.ZonalAttributesTable(url, idField='zone', attribList=['a', 'b'])
+    assert t.query([1, 500], extent=(0., 0., 100., 100.), sr=3857) == rowsOf({1, 500})
+    assert t.query([500], extent=(400., 0., 600., 100.), sr=3857) == rowsOf({500})
+
+    # zones missing from the table--not just from the first extent--are cached as missing
+    assert t.query([7, 700], extent=(0., 0., 100., 100.), sr=3857) == rowsOf({700})
+    n = log['requests']
+    assert t.query([7, 700], extent=(600., 0., 800., 100.), sr=3857) == rowsOf({700})
+    assert log['requests'] == n
+
+    # a query that isn't by zone is still filtered by the extent
+    assert set(t.query(None, extent=(400., 0., 600., 100.), sr=3857)) == set(z for z in range(400, 601) if z % 7)
+
+
+def test_first_page_without_attributes(service):
+    url, log = service
+    t = utils.ZonalAttributesTable(url, idField='zone', attribList=['a', 'b'])
+    T = t.query(list(range(1, 120)), where='bare', firstRowOnly=True)
+    rows = [r for r in ROWS if 1 <= r['zone'] < 120][PAGE:]                      # the first page's rows are bare
+    assert T == {z: R[:1] for z, R in rowsOf(set(r['zone'] for r in rows)).items()}
+
+
+def test_errors(service):
+    url, log = service
+    t = utils.ZonalAttributesTable(url, idField='zone', attribList=['a', 'b'])
+    with pytest.raises(Exception, match='Invalid where clause'):
+        t.query([1], where='invalid')
+    with pytest.raises(Exception, match='HTTP status 503'):
+        t.query([2], where='unavailable')
+    assert t.connections.empty()            # the failed exchange's connection isn't reused